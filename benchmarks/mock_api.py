@@ -0,0 +1,295 @@
+"""
+Local mock of the YouTube Data API and of the Google Drive upload endpoints.
+
+The server answers the requests of the youtube module without the network and
+without spending quota:
+- GET  /youtube/v3/search  - pages of generated search results with nextPageToken;
+- GET  /youtube/v3/videos  - snippet and statistics of up to 50 IDs;
+- GET  /youtube/v3/channels - statistics of up to 50 channel IDs;
+- GET  /drive/v3/files     - file search by name (always empty);
+- POST /upload/drive/v3/files, PATCH /upload/drive/v3/files/{id} - start of a resumable upload;
+- PUT  /upload/drive/v3/files?upload_id=... - chunks of the upload (308 until the last one);
+- GET  /_stats             - request counters of the server.
+
+The answers are deterministic: the results of a keyword are the IDs '<keyword>-<n>',
+the same keyword always finds the same videos. Latency, the share of 5xx and 429
+answers and the quota of every API key can be configured. Like Google APIs, the
+server applies the fields= partial response selector and gzip-compresses the
+answers of a client whose User-Agent contains "gzip".
+
+Usage:
+    python benchmarks/mock_api.py --port 8080 --latency 0.02 --error-rate 0.01
+    python youtube.py ...  # with YouTubeClient(api_root='http://127.0.0.1:8080')
+"""
+
+
+import argparse
+import asyncio
+import json
+import random
+import uuid
+from collections import Counter
+
+from aiohttp import web
+
+
+SEARCH_COST = 100
+VIDEOS_COST = 1
+CHANNELS_COST = 1
+
+
+def _parse_element(text: str, i: int) -> tuple:
+    """Parses one element of a fields selector: name, name/element or name(elements)."""
+    j = i
+    while j < len(text) and text[j] not in ',()/':
+        j += 1
+    name = text[i:j]
+    if j < len(text) and text[j] == '/':
+        sub_name, sub_tree, j = _parse_element(text, j + 1)
+        return name, {sub_name: sub_tree}, j
+    if j < len(text) and text[j] == '(':
+        tree, j = _parse_elements(text, j + 1)
+        return name, tree, j + 1
+    return name, None, j
+
+
+def _parse_elements(text: str, i: int = 0) -> tuple:
+    """Parses a comma-separated list of the elements of a fields selector.
+
+    :return: tuple ({name: subtree or None}, position after the list).
+    """
+    tree = {}
+    while i < len(text) and text[i] != ')':
+        name, sub_tree, i = _parse_element(text, i)
+        tree[name] = sub_tree
+        if i < len(text) and text[i] == ',':
+            i += 1
+    return tree, i
+
+
+def select_fields(value, tree):
+    """Keeps the fields of the parsed selector in the answer (lists are filtered item by item)."""
+    if tree is None:
+        return value
+    if isinstance(value, list):
+        return [select_fields(item, tree) for item in value]
+    if isinstance(value, dict):
+        return {name: select_fields(value[name], sub_tree) for name, sub_tree in tree.items() if name in value}
+    return value
+
+
+class MockApi:
+    """Settings, counters and request handlers of the mock server."""
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 rate_limit_rate: float = 0.0, results_per_query: int = 500, quota_units: int = None,
+                 seed: int = 0):
+        """
+        :param latency: seconds added to every answer.
+        :param jitter: random seconds (0..jitter) added to the latency.
+        :param error_rate: share of the API requests answered with 500/503.
+        :param rate_limit_rate: share of the API requests answered with 429.
+        :param results_per_query: number of search results of every keyword.
+        :param quota_units: daily units of every API key, None - no quota errors.
+        :param seed: seed of the random latency and errors.
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.results_per_query = results_per_query
+        self.quota_units = quota_units
+        self.random = random.Random(seed)
+        self.requests = Counter()  # {endpoint: requests}
+        self.errors = Counter()  # {status: answers}
+        self.spent = Counter()  # {api_key: units}
+        self.uploads = {}  # {upload_id: received bytes}
+
+    def make_app(self) -> web.Application:
+        app = web.Application(client_max_size=1024 ** 3)
+        app.router.add_get('/youtube/v3/search', self.search)
+        app.router.add_get('/youtube/v3/videos', self.videos)
+        app.router.add_get('/youtube/v3/channels', self.channels)
+        app.router.add_get('/drive/v3/files', self.drive_list)
+        app.router.add_post('/upload/drive/v3/files', self.upload_start)
+        app.router.add_patch('/upload/drive/v3/files/{file_id}', self.upload_start)
+        app.router.add_put('/upload/drive/v3/files', self.upload_chunk)
+        app.router.add_put('/upload/drive/v3/files/{file_id}', self.upload_chunk)
+        app.router.add_get('/_stats', self.stats)
+        return app
+
+    async def _delay(self) -> None:
+        delay = self.latency + self.random.uniform(0, self.jitter)
+        if delay:
+            await asyncio.sleep(delay)
+
+    def _error(self, name: str, api_key: str, cost: int):
+        """Returns the injected error answer of an API request or None."""
+        self.requests[name] += 1
+        roll = self.random.random()
+        if roll < self.error_rate:
+            status = self.random.choice((500, 503))
+            self.errors[status] += 1
+            return web.json_response({'error': {'code': status, 'errors': [{'reason': 'backendError'}]}},
+                                     status=status)
+        if roll < self.error_rate + self.rate_limit_rate:
+            self.errors[429] += 1
+            return web.json_response({'error': {'code': 429, 'errors': [{'reason': 'rateLimitExceeded'}]}},
+                                     status=429)
+        if self.quota_units is not None and self.spent[api_key] + cost > self.quota_units:
+            self.errors[403] += 1
+            return web.json_response({'error': {'code': 403, 'errors': [{'reason': 'quotaExceeded'}]}},
+                                     status=403)
+        self.spent[api_key] += cost
+        return None
+
+    def _answer(self, request: web.Request, body: dict, headers: dict = None) -> web.Response:
+        """Answers like Google APIs: applies the fields selector and compresses the
+        answer only for a User-Agent with "gzip".
+        """
+        if request.query.get('fields'):
+            body = select_fields(body, _parse_elements(request.query['fields'])[0])
+        response = web.json_response(body, headers=headers)
+        if 'gzip' in request.headers.get('User-Agent', '') and 'gzip' in request.headers.get('Accept-Encoding', ''):
+            response.enable_compression(web.ContentCoding.gzip)
+            self.requests['compressed'] += 1
+        return response
+
+    async def search(self, request: web.Request) -> web.Response:
+        await self._delay()
+        error = self._error('search', request.query.get('key'), SEARCH_COST)
+        if error is not None:
+            return error
+
+        query = request.query.get('q', '')
+        page_size = min(int(request.query.get('maxResults', 5)), 50)
+        start = int(request.query.get('pageToken') or 0)
+        end = min(start + page_size, self.results_per_query)
+        body = {
+            'kind': 'youtube#searchListResponse',
+            'pageInfo': {'totalResults': self.results_per_query, 'resultsPerPage': page_size},
+            'items': [{'kind': 'youtube#searchResult', 'id': {'kind': 'youtube#video', 'videoId': f'{query}-{n}'},
+                       'snippet': {'title': f'Video {n} for {query}'}} for n in range(start, end)],
+        }
+        if end < self.results_per_query:
+            body['nextPageToken'] = str(end)
+        return self._answer(request, body)
+
+    async def videos(self, request: web.Request) -> web.Response:
+        await self._delay()
+        error = self._error('videos', request.query.get('key'), VIDEOS_COST)
+        if error is not None:
+            return error
+
+        video_ids = [video_id for video_id in request.query.get('id', '').split(',') if video_id][:50]
+        parts = request.query.get('part', 'snippet,statistics').split(',')
+        items = []
+        for video_id in video_ids:
+            number = sum(map(ord, video_id))
+            item = {'kind': 'youtube#video', 'id': video_id}
+            if 'snippet' in parts:
+                item['snippet'] = {'title': f'Title of {video_id}', 'channelId': f'UC{number % 1000:04d}',
+                                   'channelTitle': f'Channel {number % 1000}',
+                                   'publishedAt': '2024-01-01T00:00:00Z'}
+            if 'statistics' in parts:
+                item['statistics'] = {'viewCount': str(number * 37), 'likeCount': str(number),
+                                      'commentCount': str(number % 97)}
+            items.append(item)
+        return self._answer(request, {'kind': 'youtube#videoListResponse', 'items': items},
+                            headers={'ETag': f'"{hash(tuple(video_ids)) & 0xffffffff:x}"'})
+
+    async def channels(self, request: web.Request) -> web.Response:
+        await self._delay()
+        error = self._error('channels', request.query.get('key'), CHANNELS_COST)
+        if error is not None:
+            return error
+
+        channel_ids = [channel_id for channel_id in request.query.get('id', '').split(',') if channel_id][:50]
+        items = []
+        for channel_id in channel_ids:
+            number = sum(map(ord, channel_id))
+            items.append({'kind': 'youtube#channel', 'id': channel_id,
+                          'statistics': {'subscriberCount': str(number * 11), 'viewCount': str(number * 1009),
+                                         'videoCount': str(number % 300)}})
+        return self._answer(request, {'kind': 'youtube#channelListResponse', 'items': items})
+
+    async def drive_list(self, request: web.Request) -> web.Response:
+        self.requests['drive.list'] += 1
+        return web.json_response({'files': []})
+
+    async def upload_start(self, request: web.Request) -> web.Response:
+        await self._delay()
+        self.requests['drive.upload'] += 1
+        await request.read()
+        upload_id = uuid.uuid4().hex
+        self.uploads[upload_id] = 0
+        location = request.url.with_query({'uploadType': 'resumable', 'upload_id': upload_id})
+        return web.Response(headers={'Location': str(location)})
+
+    async def upload_chunk(self, request: web.Request) -> web.Response:
+        await self._delay()
+        self.requests['drive.chunk'] += 1
+        upload_id = request.query.get('upload_id')
+        if upload_id not in self.uploads:
+            return web.json_response({'error': {'code': 404, 'message': 'Unknown upload'}}, status=404)
+
+        chunk = await request.read()
+        self.uploads[upload_id] += len(chunk)
+        # Content-Range: bytes 0-262143/1000000 (the total is '*' until the last chunk)
+        total = request.headers.get('Content-Range', '').rpartition('/')[2]
+        if total.isdigit() and self.uploads[upload_id] >= int(total):
+            return web.json_response({'id': request.match_info.get('file_id', upload_id)})
+        return web.Response(status=308, headers={'Range': f'bytes=0-{self.uploads[upload_id] - 1}'})
+
+    async def stats(self, request: web.Request) -> web.Response:
+        return web.json_response({'requests': dict(self.requests), 'errors': dict(self.errors),
+                                  'spent': dict(self.spent),
+                                  'uploaded_bytes': sum(self.uploads.values())})
+
+
+async def serve(api: MockApi, host: str = '127.0.0.1', port: int = 0) -> tuple:
+    """Starts the server in the running event loop.
+
+    :return: tuple (web.AppRunner, base URL); call runner.cleanup() to stop the server.
+    """
+    runner = web.AppRunner(api.make_app(), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f'http://{host}:{port}'
+
+
+async def _run_forever(api: MockApi, host: str, port: int) -> None:
+    runner, url = await serve(api, host, port)
+    print(url, flush=True)  # the first line tells the benchmark where to connect
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+def parse_args(argv: list = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Local mock of the YouTube Data API and Google Drive uploads.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=0, help='0 - any free port, printed on start')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every answer')
+    parser.add_argument('--jitter', type=float, default=0.0, help='random seconds added to the latency')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of 500/503 answers')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='share of 429 answers')
+    parser.add_argument('--results-per-query', type=int, default=500, help='search results of every keyword')
+    parser.add_argument('--quota-units', type=int, help='daily units of every API key (quotaExceeded above)')
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    api = MockApi(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                  rate_limit_rate=args.rate_limit_rate, results_per_query=args.results_per_query,
+                  quota_units=args.quota_units, seed=args.seed)
+    try:
+        asyncio.run(_run_forever(api, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    print(json.dumps({'requests': dict(api.requests), 'errors': dict(api.errors)}))
@@ -0,0 +1,87 @@
+"""
+Cold-start benchmark of the youtube module.
+
+Every scenario runs in a fresh interpreter with `python -X importtime`, the
+script reports the wall time of the process and the total import time, and
+the slowest imported modules of the last run.
+
+Scenarios:
+- search: `import youtube` - what every search/refresh run pays.
+- upload: `import youtube` plus the Google Drive modules loaded for an upload.
+
+Usage:
+    python benchmarks/startup.py            # 10 runs of every scenario
+    python benchmarks/startup.py -r 30 -t 5
+"""
+
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = {
+    'search': 'import youtube',
+    'upload': 'import youtube; youtube._load_drive_modules()',
+}
+
+
+def parse_importtime(stderr: str) -> list:
+    """Parses the output of -X importtime.
+
+    :param stderr: standard error of the process.
+    :return: list of tuples (module, self microseconds, cumulative microseconds, depth).
+    """
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        modules.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return modules
+
+
+def run_scenario(code: str) -> tuple:
+    """Runs the code in a fresh interpreter.
+
+    :param code: Python code of the scenario.
+    :return: tuple (wall milliseconds, import milliseconds, parsed importtime).
+    """
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=ROOT,
+                             capture_output=True, text=True, check=True)
+    wall_ms = (time.perf_counter() - start) * 1000
+    modules = parse_importtime(process.stderr)
+    import_ms = sum(cumulative for _, _, cumulative, depth in modules if depth == 0) / 1000
+    return wall_ms, import_ms, modules
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Cold-start benchmark of the youtube module.')
+    parser.add_argument('-r', '--runs', type=int, default=10, help='runs of every scenario')
+    parser.add_argument('-t', '--top', type=int, default=10, help='slowest modules to show')
+    parser.add_argument('scenarios', nargs='*', default=list(SCENARIOS), help='scenarios to run')
+    args = parser.parse_args()
+
+    for name in args.scenarios:
+        walls, imports = [], []
+        for _ in range(args.runs):
+            wall_ms, import_ms, modules = run_scenario(SCENARIOS[name])
+            walls.append(wall_ms)
+            imports.append(import_ms)
+
+        print(f'{name}: wall min {min(walls):.1f} ms, median {statistics.median(walls):.1f} ms; '
+              f'imports min {min(imports):.1f} ms, median {statistics.median(imports):.1f} ms')
+        top_level = sorted((m for m in modules if m[3] <= 1), key=lambda m: m[2], reverse=True)
+        for module, _, cumulative, _ in top_level[:args.top]:
+            print(f'    {cumulative / 1000:8.1f} ms  {module}')
+
+
+if __name__ == '__main__':
+    main()
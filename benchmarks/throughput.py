@@ -0,0 +1,210 @@
+"""
+Throughput and latency benchmark of the youtube pipeline against the local mock API.
+
+The mock server (benchmarks/mock_api.py) runs in its own process, so it does not
+compete with the measured client for the event loop. Every scenario runs what
+main() and main_batch() do - the keyword searches, the videos.list batches and
+the CSV writer of run_pipeline, then the resumable upload of the CSV file to the
+mock Drive - and reports:
+- wall time and videos per second;
+- requests per endpoint and the answered errors (retried by the client);
+- p50/p95/p99 latency of the HTTP requests (aiohttp TraceConfig);
+- peak memory of the Python allocations (tracemalloc) or the peak RSS.
+
+Scenarios: 50, 5000 and 100000 videos (keywords of 500 results each).
+
+Usage:
+    python benchmarks/throughput.py                      # all scenarios
+    python benchmarks/throughput.py 50 5000 --latency 0.02 --error-rate 0.01
+    python benchmarks/throughput.py --json results.json  # keep the numbers for comparison
+"""
+
+
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import urllib.request
+from collections import Counter, defaultdict
+
+import aiohttp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import youtube  # noqa: E402
+
+
+SCENARIOS = [50, 5000, 100000]
+RESULTS_PER_QUERY = 500
+
+
+def percentile(values: list, share: float) -> float:
+    """Returns the percentile of the values (nearest rank)."""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, math.ceil(share * len(values)) - 1))]
+
+
+def make_trace_config(latencies: dict, statuses: Counter) -> aiohttp.TraceConfig:
+    """Creates a TraceConfig that records the latency of every request by endpoint.
+
+    :param latencies: dictionary {endpoint: [seconds]} filled by the trace.
+    :param statuses: counter of the answered statuses filled by the trace.
+    """
+    async def on_request_start(session, context, params):
+        context.start = asyncio.get_running_loop().time()
+
+    async def on_request_end(session, context, params):
+        endpoint = params.url.path.rsplit('/', 1)[-1]
+        latencies[endpoint].append(asyncio.get_running_loop().time() - context.start)
+        statuses[params.response.status] += 1
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_request_end.append(on_request_end)
+    return trace_config
+
+
+def start_mock_server(args: argparse.Namespace) -> tuple:
+    """Starts benchmarks/mock_api.py in a separate process.
+
+    :return: tuple (process, base URL).
+    """
+    command = [sys.executable, os.path.join(ROOT, 'benchmarks', 'mock_api.py'),
+               '--latency', str(args.latency), '--jitter', str(args.jitter),
+               '--error-rate', str(args.error_rate), '--rate-limit-rate', str(args.rate_limit_rate),
+               '--results-per-query', str(RESULTS_PER_QUERY)]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    return process, process.stdout.readline().strip()
+
+
+def get_server_stats(url: str) -> dict:
+    with urllib.request.urlopen(url + '/_stats') as response:
+        return json.load(response)
+
+
+def make_drive_service(url: str):
+    """Creates a Google Drive client of the mock server (no credentials are needed).
+    The upload address of the discovery document keeps its https scheme when the
+    endpoint is replaced, the requests are sent to the plain HTTP mock instead.
+    """
+    from google.auth.credentials import AnonymousCredentials
+    from googleapiclient.discovery import build
+    from googleapiclient.http import HttpRequest
+
+    class MockHttpRequest(HttpRequest):
+        def __init__(self, http, postproc, uri, *args, **kwargs):
+            super().__init__(http, postproc, uri.replace('https://', 'http://', 1), *args, **kwargs)
+
+    return build('drive', 'v3', credentials=AnonymousCredentials(), static_discovery=True,
+                 cache_discovery=False, client_options={'api_endpoint': url + '/drive/v3/'},
+                 requestBuilder=MockHttpRequest)
+
+
+async def run_crawl(videos: int, url: str, filename: str, trace_config: aiohttp.TraceConfig) -> int:
+    """Runs the searches and the CSV writer for the number of videos."""
+    queries = [f'bench{videos}q{n}' for n in range(math.ceil(videos / RESULTS_PER_QUERY))]
+    scheduler = youtube.QuotaScheduler(daily_units=10 ** 9, requests_per_second=10 ** 6, burst=10 ** 6)
+    async with youtube.YouTubeClient(api_key='bench', scheduler=scheduler, api_root=url,
+                                     trace_configs=[trace_config], retry_base_delay=0.01,
+                                     retry_max_delay=0.1) as client:
+        return await youtube.run_pipeline(queries, client, max_results=min(videos, RESULTS_PER_QUERY),
+                                          exporter=youtube.CsvExporter(filename))
+
+
+def run_scenario(videos: int, url: str, measure_memory: bool) -> dict:
+    """Runs one scenario and returns its measurements."""
+    latencies, statuses = defaultdict(list), Counter()
+    requests_before = get_server_stats(url)['requests']
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filename = os.path.join(tmpdir, f'bench_{videos}.csv')
+        if measure_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        rows = asyncio.run(run_crawl(videos, url, filename, make_trace_config(latencies, statuses)))
+        crawl_seconds = time.perf_counter() - start
+        if measure_memory:
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        else:
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+        start = time.perf_counter()
+        upload_message = youtube.upload_to_drive(filename, service=make_drive_service(url))
+        upload_seconds = time.perf_counter() - start
+
+    requests_after = get_server_stats(url)['requests']
+    all_latencies = [seconds for values in latencies.values() for seconds in values]
+    return {
+        'videos': videos,
+        'rows': rows,
+        'crawl_seconds': round(crawl_seconds, 3),
+        'videos_per_second': round(rows / crawl_seconds, 1) if crawl_seconds else 0,
+        'upload_seconds': round(upload_seconds, 3),
+        'upload_ok': 'ID' in upload_message,
+        'requests': {endpoint: count - requests_before.get(endpoint, 0)
+                     for endpoint, count in requests_after.items()
+                     if count - requests_before.get(endpoint, 0)},
+        'errors': {str(status): count for status, count in statuses.items() if status >= 400},
+        'latency_ms': {
+            endpoint: {name: round(percentile(values, share) * 1000, 2)
+                       for name, share in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99))}
+            for endpoint, values in list(latencies.items()) + [('all', all_latencies)]
+        },
+        'peak_memory_mb': round(peak / 1024 ** 2, 1),
+        'memory_source': 'tracemalloc' if measure_memory else 'ru_maxrss',
+    }
+
+
+def print_result(result: dict) -> None:
+    print(f"{result['videos']} videos: {result['rows']} rows in {result['crawl_seconds']:.2f} s "
+          f"({result['videos_per_second']:.0f} videos/s), upload {result['upload_seconds']:.2f} s"
+          f"{'' if result['upload_ok'] else ' FAILED'}, peak memory {result['peak_memory_mb']} MB "
+          f"({result['memory_source']})")
+    print(f"    requests: {result['requests']}, errors: {result['errors'] or 'none'}")
+    for endpoint, latency in result['latency_ms'].items():
+        print(f"    {endpoint:>8}: p50 {latency['p50']:.2f} ms, p95 {latency['p95']:.2f} ms, "
+              f"p99 {latency['p99']:.2f} ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Throughput benchmark of the youtube pipeline (mock API).')
+    parser.add_argument('videos', nargs='*', type=int, default=SCENARIOS, help='videos of every scenario')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every mock answer')
+    parser.add_argument('--jitter', type=float, default=0.0, help='random seconds added to the latency')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of 500/503 answers')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='share of 429 answers')
+    parser.add_argument('--no-tracemalloc', action='store_true',
+                        help='report the peak RSS instead of tracing the allocations (faster)')
+    parser.add_argument('--json', help='file to save the results to')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)  # retries of the injected errors are expected
+    process, url = start_mock_server(args)
+    try:
+        results = []
+        for videos in args.videos:
+            result = run_scenario(videos, url, measure_memory=not args.no_tracemalloc)
+            print_result(result)
+            results.append(result)
+    finally:
+        process.terminate()
+        process.wait()
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
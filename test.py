@@ -4,10 +4,54 @@ import requests
 from aiohttp import ClientResponseError
 from aiohttp.helpers import BasicAuth
 import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import csv
+from datetime import date, datetime, timezone
+import gzip
+import importlib.util
+import io
+import json
+import logging
+import logging.handlers
+import multiprocessing
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+
+import youtube
+
+from youtube import (search_youtube, fetch_video_details, gather_video_info, save_to_csv, upload_to_drive,
+                     VideoBatcher, YouTubeClient, iter_search_results, crawl_keywords, read_keywords,
+                     fetch_videos_batch, ResponseCache, StatsStore, refresh_statistics,
+                     run_pipeline, make_exporter, get_drive_service,
+                     QuotaScheduler, QuotaExceeded, ApiKeyPool, crawl_sharded, Metrics, api_fields,
+                     VideoRecord, VideoColumns, ChannelCache, YOUTUBE_API_KEY, VIDEO_URL, YOUTUBE_API_URL, SERVICE_ACCOUNT_FILE, SCOPES)
+
+
+def mock_response(status: int, body: str, headers: dict = None) -> MagicMock:
+    """Builds the async context manager returned by the patched ClientSession.get."""
+    result = MagicMock()
+    result.status = status
+    result.read = AsyncMock(return_value=body.encode('utf-8'))
+    result.headers = headers or {}
+    result.raise_for_status = MagicMock()
+    context = MagicMock()
+    context.__aenter__ = AsyncMock(return_value=result)
+    context.__aexit__ = AsyncMock(return_value=False)
+    return context
+
+
+def load_mock_api():
+    """Loads benchmarks/mock_api.py (the benchmarks directory is not a package)."""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks', 'mock_api.py')
+    spec = importlib.util.spec_from_file_location('mock_api', path)
+    mock_api = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mock_api)
+    return mock_api
 
 
-from youtube import search_youtube, fetch_video_details, gather_video_info, save_to_csv, upload_to_drive
-
 class TestYoutubeFunctions(unittest.TestCase):
 
     @patch('requests.get')
@@ -36,12 +80,9 @@ class TestYoutubeFunctions(unittest.TestCase):
         self.assertEqual(result, {})
         mock_get.assert_called_once()
 
-    @patch('aiohttp.ClientSession.get', new_callable=AsyncMock)
-    @patch('aiohttp.ClientSession.__aenter__', new_callable=AsyncMock)
-    @patch('aiohttp.ClientSession.__aexit__', new_callable=AsyncMock)
-    def test_fetch_video_details_success(self, mock_aexit, mock_aenter, mock_get):
-        mock_aenter.return_value = MagicMock()
-        mock_aenter.return_value.get.return_value.__aenter__.return_value.json.return_value = {
+    @patch('youtube.YouTubeClient.get_json', new_callable=AsyncMock)
+    def test_fetch_video_details_success(self, mock_get_json):
+        mock_get_json.return_value = {
             'id': '12345',
             'snippet': {'title': 'Sample Video'},
             'statistics': {'viewCount': '1000'}
@@ -53,13 +94,11 @@ class TestYoutubeFunctions(unittest.TestCase):
         # Assert
         self.assertEqual(result['id'], '12345')
         self.assertEqual(result['snippet']['title'], 'Sample Video')
+        mock_get_json.assert_called_once_with(VIDEO_URL, {'part': 'statistics,snippet', 'id': '12345'})
 
-    @patch('aiohttp.ClientSession.get', new_callable=AsyncMock)
-    @patch('aiohttp.ClientSession.__aenter__', new_callable=AsyncMock)
-    @patch('aiohttp.ClientSession.__aexit__', new_callable=AsyncMock)
-    def test_fetch_video_details_failure(self, mock_aexit, mock_aenter, mock_get):
-        mock_aenter.return_value = MagicMock()
-        mock_get.side_effect = ClientResponseError(
+    @patch('youtube.YouTubeClient.get_json', new_callable=AsyncMock)
+    def test_fetch_video_details_failure(self, mock_get_json):
+        mock_get_json.side_effect = ClientResponseError(
             request_info=MagicMock(),  # Создаем фиктивный объект для request_info
             history=[]  # Пустой список истории
         )
@@ -69,13 +108,322 @@ class TestYoutubeFunctions(unittest.TestCase):
         # Assert
         self.assertEqual(result, {})
 
-    @patch('youtube.fetch_video_details', new_callable=AsyncMock)
-    def test_gather_video_info_success(self, mock_fetch_video_details):
-        mock_fetch_video_details.side_effect = [{
-            'id': '12345',
-            'snippet': {'title': 'Sample Video'},
-            'statistics': {'viewCount': '1000'}
-        }] * 2
+    @patch('aiohttp.ClientSession.get')
+    def test_youtube_client_shares_session(self, mock_get):
+        response = mock_get.return_value.__aenter__.return_value
+        response.status = 200
+        response.raise_for_status = MagicMock()
+        response.read = AsyncMock(return_value=b'{"items": []}')
+        response.headers = {}
+
+        async def run():
+            async with YouTubeClient(api_key='test_key', max_concurrency=2) as client:
+                session = client._session
+                await asyncio.gather(*(fetch_video_details(str(i), client=client) for i in range(5)))
+                return session, client._session
+
+        session, session_after = asyncio.run(run())
+
+        # Assert: все запросы прошли через одну сессию, ключ добавлен клиентом
+        self.assertIs(session, session_after)
+        self.assertEqual(mock_get.call_count, 5)
+        self.assertEqual(mock_get.call_args.kwargs['params']['key'], 'test_key')
+
+    def test_quota_scheduler_budget(self):
+        async def run(scheduler):
+            await scheduler.acquire(YOUTUBE_API_URL)  # 100 единиц
+            with self.assertRaises(QuotaExceeded):
+                # Остаток ниже порога - дорогой поиск не отправляется
+                await scheduler.acquire(YOUTUBE_API_URL)
+            for _ in range(150):
+                await scheduler.acquire(VIDEO_URL)  # дешёвые запросы продолжаются
+            with self.assertRaises(QuotaExceeded):
+                await scheduler.acquire(VIDEO_URL)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            state_file = os.path.join(tmpdir, 'quota.json')
+            scheduler = QuotaScheduler(daily_units=250, requests_per_second=1000, burst=1000,
+                                       low_water=0.5, state_file=state_file)
+            asyncio.run(run(scheduler))
+
+            # Assert: бюджет исчерпан и сохранён для следующего запуска
+            self.assertTrue(scheduler.exhausted)
+            self.assertEqual(scheduler.spent, 250)
+            self.assertEqual(QuotaScheduler(daily_units=250, state_file=state_file).remaining, 0)
+
+    def test_quota_scheduler_refused_search_keeps_cheap_requests(self):
+        async def run(scheduler):
+            with self.assertRaises(QuotaExceeded):
+                await scheduler.acquire(YOUTUBE_API_URL)  # 100 единиц при остатке 45
+            await scheduler.acquire(VIDEO_URL)
+
+        scheduler = QuotaScheduler(daily_units=1000, requests_per_second=1000, burst=1000)
+        scheduler.spent = 955
+        asyncio.run(run(scheduler))
+
+        # Assert: отказ в поиске не исчерпывает бюджет, дешёвый запрос оплачен
+        self.assertFalse(scheduler.exhausted)
+        self.assertEqual(scheduler.spent, 956)
+
+    def test_worker_process_logs_reach_parent(self):
+        log_queue = multiprocessing.Queue()
+        listener = logging.handlers.QueueListener(log_queue, youtube._ForwardHandler())
+        handler = logging.handlers.BufferingHandler(capacity=100)
+        logging.getLogger().addHandler(handler)
+        listener.start()
+        try:
+            with ProcessPoolExecutor(1, initializer=youtube._init_worker_logging,
+                                     initargs=(log_queue, logging.INFO)) as executor:
+                worker_pid = executor.submit(os.getpid).result()
+                executor.submit(youtube.logger.warning, 'quota warning in worker').result()
+        finally:
+            listener.stop()  # the queued records are handled before stop() returns
+            logging.getLogger().removeHandler(handler)
+
+        # Assert: запись процесса-исполнителя передана обработчикам основного процесса
+        records = [record for record in handler.buffer if record.name == 'youtube']
+        self.assertEqual([record.getMessage() for record in records], ['quota warning in worker'])
+        self.assertEqual(records[0].process, worker_pid)
+
+    @patch('aiohttp.ClientSession.get')
+    def test_youtube_client_retries_and_quota_exceeded(self, mock_get):
+        quota_error = '{"error": {"errors": [{"reason": "quotaExceeded"}]}}'
+        mock_get.side_effect = [mock_response(429, ''), mock_response(503, ''),
+                                mock_response(200, '{"items": []}'), mock_response(403, quota_error)]
+
+        async def run():
+            async with YouTubeClient(retry_base_delay=0) as client:
+                first = await client.get_json(VIDEO_URL, {'id': '1'})
+                second = await fetch_videos_batch(['2'], client=client)
+                return first, second, client.scheduler
+
+        first, second, scheduler = asyncio.run(run())
+
+        # Assert: 429 и 503 повторены, quotaExceeded останавливает запросы
+        self.assertEqual(first, {'items': []})
+        self.assertEqual(second, {})
+        self.assertEqual(mock_get.call_count, 4)
+        self.assertTrue(scheduler.exhausted)
+
+    @patch('aiohttp.ClientSession.get')
+    def test_metrics_record_requests_retries_and_trace(self, mock_get):
+        videos_body = '{"items": [{"snippet": {"title": "Котики"}}]}'
+        mock_get.side_effect = [mock_response(503, ''), mock_response(200, videos_body),
+                                mock_response(200, '{"items": []}', {'Content-Length': '12'})]  # сжатый ответ
+        metrics = Metrics()
+
+        async def run():
+            async with YouTubeClient(metrics=metrics, retry_base_delay=0) as client:
+                await client.get_json(VIDEO_URL, {'id': '1'})
+                await client.get_json(YOUTUBE_API_URL, {'q': 'test'})
+
+        with self.assertLogs('youtube.trace', level='DEBUG') as trace:
+            asyncio.run(run())
+
+        # Assert: запросы по методам, повтор и единицы квоты учтены, каждый запрос в трассировке
+        summary = metrics.to_dict()
+        self.assertEqual(summary['videos']['requests'], {'200': 1, '503': 1})
+        self.assertEqual(summary['videos']['retries'], 1)
+        self.assertEqual(summary['videos']['bytes'], len(videos_body.encode('utf-8')))  # байты, а не символы
+        self.assertEqual(summary['search']['bytes'], 12)
+        self.assertEqual(summary['search']['quota_units'], 100)
+        self.assertEqual([json.loads(record.getMessage())['status'] for record in trace.records], [503, 200, 200])
+        text = metrics.to_prometheus()
+        self.assertIn('youtube_api_requests_total{endpoint="videos",status="503"} 1', text)
+        self.assertIn('youtube_api_request_duration_seconds_count{endpoint="search"} 1', text)
+
+    @patch('aiohttp.ClientSession.get')
+    def test_api_key_pool_switches_key_on_quota_exceeded(self, mock_get):
+        quota_error = '{"error": {"errors": [{"reason": "quotaExceeded"}]}}'
+        mock_get.side_effect = [mock_response(403, quota_error), mock_response(200, '{"items": []}')]
+        key_pool = ApiKeyPool({'key_a': QuotaScheduler(daily_units=1000), 'key_b': QuotaScheduler(daily_units=500)})
+
+        async def run():
+            async with YouTubeClient(key_pool=key_pool, retry_base_delay=0) as client:
+                return await client.get_json(VIDEO_URL, {'id': '1'})
+
+        result = asyncio.run(run())
+
+        # Assert: сначала ключ с большим остатком, после quotaExceeded - следующий ключ
+        self.assertEqual(result, {'items': []})
+        keys = [call.kwargs['params']['key'] for call in mock_get.call_args_list]
+        self.assertEqual(keys, ['key_a', 'key_b'])
+        self.assertTrue(key_pool.schedulers['key_a'].exhausted)
+        self.assertFalse(key_pool.exhausted)
+
+    @patch('youtube.ProcessPoolExecutor', new=ThreadPoolExecutor)
+    @patch('youtube._init_worker_logging')  # потоки используют журнал тестового процесса
+    @patch('youtube.fetch_videos_batch', new_callable=AsyncMock)
+    @patch('youtube.iter_search_results')
+    def test_crawl_sharded_merges_shards(self, mock_iter_search_results, mock_fetch_videos_batch,
+                                         mock_init_worker_logging):
+        found = {'q1': ['v1', 'v2'], 'q2': ['v2', 'v3'], 'q3': ['v4']}
+
+        async def search(query, client, max_results):
+            await client.key_pool.acquire(YOUTUBE_API_URL)  # единицы списываются с ключа процесса
+            for video_id in found[query]:
+                yield {'id': {'videoId': video_id}}
+
+        async def fetch_batch(video_ids, client):
+            await client.key_pool.acquire(VIDEO_URL)
+            return {'items': [{'id': video_id, 'snippet': {'title': video_id}} for video_id in video_ids]}
+
+        mock_iter_search_results.side_effect = search
+        mock_fetch_videos_batch.side_effect = fetch_batch
+        key_pool = ApiKeyPool({'key_a': QuotaScheduler(daily_units=1000, requests_per_second=10)})
+        shard_keys = youtube._shard_keys(key_pool, 2)
+
+        result = crawl_sharded(['q1', 'q2', 'q3'], key_pool, processes=2)
+
+        # Assert: видео в порядке ключевых слов без повторов, бюджет ключа поделён между процессами
+        self.assertEqual(list(result), ['v1', 'v2', 'v3', 'v4'])
+        self.assertEqual(result['v2']['queries'], ['q1', 'q2'])
+        self.assertEqual(mock_fetch_videos_batch.call_count, 1)
+        self.assertEqual(shard_keys, [[('key_a', 500, 5.0)], [('key_a', 500, 5.0)]])
+        self.assertEqual(key_pool.schedulers['key_a'].spent, 3 * 100 + 1)  # траты процессов учтены в ключе
+
+    @patch('aiohttp.ClientSession.get')
+    def test_response_cache_ttl_and_etag(self, mock_get):
+        response = mock_get.return_value.__aenter__.return_value
+        response.status = 200
+        response.raise_for_status = MagicMock()
+        response.read = AsyncMock(return_value=b'{"items": [{"id": "12345"}]}')
+        response.headers = {'ETag': '"v1"'}
+
+        async def fetch_twice(cache):
+            async with YouTubeClient(cache=cache) as client:
+                first = await fetch_videos_batch(['12345'], client=client)
+                second = await fetch_videos_batch(['12345'], client=client)
+                return first, second
+
+        with tempfile.TemporaryDirectory() as tmpdir, \
+                ResponseCache(os.path.join(tmpdir, 'cache.sqlite')) as cache:
+            # Второй запрос берётся из кэша без обращения к API
+            first, second = asyncio.run(fetch_twice(cache))
+            self.assertEqual(first, second)
+            self.assertEqual(mock_get.call_count, 1)
+
+            # Устаревший ответ проверяется по ETag, 304 возвращает сохранённые данные
+            cache.statistics_ttl = 0
+            response.status = 304
+            first, second = asyncio.run(fetch_twice(cache))
+            self.assertEqual(second['items'][0]['id'], '12345')
+            self.assertEqual(mock_get.call_args.kwargs['headers'], {'If-None-Match': '"v1"'})
+            self.assertEqual(cache.stats()['revalidated'], 2)
+            self.assertEqual(cache.stats()['hits'], 1)
+
+    def test_response_cache_lru_eviction(self):
+        with tempfile.TemporaryDirectory() as tmpdir, \
+                ResponseCache(os.path.join(tmpdir, 'cache.sqlite'), max_bytes=35) as cache:
+            cache.put('a', VIDEO_URL, '{"n": "aaaaaaaaaa"}')
+            cache.put('b', VIDEO_URL, '{"n": "b"}')
+            cache.get('a')  # 'a' использован позже, чем 'b'
+            cache.put('c', VIDEO_URL, '{"n": "c"}')
+
+            # Assert
+            self.assertIsNotNone(cache.get('a'))
+            self.assertIsNone(cache.get('b'))
+            self.assertIsNotNone(cache.get('c'))
+
+    def test_response_cache_put_at_capacity_reads_only_evicted_rows(self):
+        class CountingConnection:
+            """Proxy of the cache connection that counts the rows read by SELECT statements."""
+
+            def __init__(self, db):
+                self.db, self.rows = db, 0
+
+            def __getattr__(self, name):
+                return getattr(self.db, name)
+
+            def execute(self, sql, *args):
+                cursor = self.db.execute(sql, *args)
+                if not sql.startswith('SELECT'):
+                    return cursor
+                connection = self
+
+                class Rows:
+                    def __iter__(self):
+                        for row in cursor:
+                            connection.rows += 1
+                            yield row
+
+                    def fetchone(self):
+                        connection.rows += 1
+                        return cursor.fetchone()
+
+                    def close(self):
+                        cursor.close()
+
+                return Rows()
+
+        with tempfile.TemporaryDirectory() as tmpdir, \
+                ResponseCache(os.path.join(tmpdir, 'cache.sqlite'), max_bytes=10000) as cache:
+            for i in range(1000):
+                cache.put(f'k{i:04}', VIDEO_URL, '0123456789')  # 10 байт, кэш заполнен
+            cache._db = CountingConnection(cache._db)
+            cache.put('new', VIDEO_URL, '0123456789')
+            evicting_rows = cache._db.rows
+            cache._db.rows = 0
+            cache.put('next', VIDEO_URL, '0123456789')
+
+            # Assert: прочитаны только удаляемые старые строки, место освобождено до 90%, следующий put не удаляет
+            self.assertLess(evicting_rows, 150)
+            self.assertEqual(cache._db.rows, 1)  # только размер прежнего ответа с тем же ключом
+            self.assertEqual(cache.stats()['size_bytes'], 9010)
+            self.assertIsNone(cache.get('k0000'))
+            self.assertIsNotNone(cache.get('k0999'))
+
+    def test_response_cache_shared_by_two_connections(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'cache.sqlite')
+            with ResponseCache(filename) as cache, ResponseCache(filename) as other:
+                cache.put('a', VIDEO_URL, '{"n": "a"}')
+                cache.get('a')
+                channel_cache = ChannelCache(filename)
+                channel_cache.get('UC1')
+                # Второй процесс пишет сразу после чтения первого (занятая база ждала бы весь timeout)
+                writer = sqlite3.connect(filename, timeout=0.1)
+                writer.execute("INSERT INTO responses VALUES ('w', ?, NULL, '{}', 2, 0, 0)", (VIDEO_URL,))
+                writer.commit()
+                writer.close()
+                other.put('b', VIDEO_URL, '{"n": "b"}')
+                channel_cache.close()
+
+                # Assert: чтение не держит блокировку, ответы одного процесса видны другому
+                self.assertIsNotNone(cache.get('b'))
+                self.assertIsNotNone(other.get('a'))
+
+    @patch('youtube.fetch_videos_batch', new_callable=AsyncMock)
+    @patch('youtube.YouTubeClient.get_json', new_callable=AsyncMock)
+    def test_iter_search_results_pagination(self, mock_get_json, mock_fetch_videos_batch):
+        def page(start, count, token):
+            result = {'items': [{'id': {'videoId': str(i)}} for i in range(start, start + count)]}
+            if token:
+                result['nextPageToken'] = token
+            return result
+        mock_get_json.side_effect = [page(0, 50, 'p2'), page(50, 50, 'p3'), page(100, 50, 'p4')]
+        mock_fetch_videos_batch.side_effect = lambda video_ids, client, part: {
+            'items': [{'id': video_id} for video_id in video_ids]}
+
+        async def run():
+            async with YouTubeClient() as client:
+                results = iter_search_results('test_query', client, max_results=120)
+                return await gather_video_info(results, client=client)
+
+        result = asyncio.run(run())
+
+        # Assert: три страницы, последняя урезана до общего лимита
+        self.assertEqual(len(result), 120)
+        self.assertEqual(mock_get_json.call_count, 3)
+        self.assertEqual(mock_get_json.call_args_list[1].args[1]['pageToken'], 'p2')
+        self.assertEqual(mock_get_json.call_args_list[2].args[1]['maxResults'], 20)
+
+    @patch('youtube.fetch_videos_batch', new_callable=AsyncMock)
+    def test_gather_video_info_success(self, mock_fetch_videos_batch):
+        mock_fetch_videos_batch.return_value = {'items': [
+            {'id': '12345', 'snippet': {'title': 'Sample Video'}, 'statistics': {'viewCount': '1000'}},
+            {'id': '67890', 'snippet': {'title': 'Sample Video'}, 'statistics': {'viewCount': '1000'}}
+        ]}
 
         video_data = {
             'items': [
@@ -87,14 +435,16 @@ class TestYoutubeFunctions(unittest.TestCase):
         result = asyncio.run(gather_video_info(video_data))
         
         # Assert
-        self.assertEqual(result['12345']['id'], '12345')
-        self.assertEqual(result['67890']['id'], '67890')
+        self.assertEqual(result['12345']['items'][0]['id'], '12345')
+        self.assertEqual(result['67890']['items'][0]['id'], '67890')
+        # Оба видео запрошены одним запросом
+        mock_fetch_videos_batch.assert_called_once_with(['12345', '67890'], client=None, part='statistics,snippet')
 
-    @patch('youtube.fetch_video_details', new_callable=AsyncMock)
-    def test_gather_video_info_with_error(self, mock_fetch_video_details):
+    @patch('youtube.fetch_videos_batch', new_callable=AsyncMock)
+    def test_gather_video_info_with_error(self, mock_fetch_videos_batch):
         # Задаём ошибку для одного из вызовов
-        mock_fetch_video_details.side_effect = [Exception("Error"), 
-            {'id': '67890', 'snippet': {'title': 'Sample Video'}, 'statistics': {'viewCount': '1000'}}]
+        mock_fetch_videos_batch.side_effect = [Exception("Error"), 
+            {'items': [{'id': '67890', 'snippet': {'title': 'Sample Video'}, 'statistics': {'viewCount': '1000'}}]}]
 
         video_data = {
             'items': [
@@ -103,12 +453,100 @@ class TestYoutubeFunctions(unittest.TestCase):
             ]
         }
 
-        result = asyncio.run(gather_video_info(video_data))
+        result = asyncio.run(gather_video_info(video_data, batcher=VideoBatcher(max_batch_size=1)))
 
         # Assert
-        self.assertEqual(result['67890']['id'], '67890')
+        self.assertEqual(result['67890']['items'][0]['id'], '67890')
         self.assertNotIn('12345', result)
 
+    @patch('youtube.fetch_videos_batch', new_callable=AsyncMock)
+    def test_video_batcher_splits_into_batches(self, mock_fetch_videos_batch):
+        async def fake_batch(video_ids, client, part):
+            return {'items': [{'id': video_id} for video_id in video_ids]}
+        mock_fetch_videos_batch.side_effect = fake_batch
+
+        async def run():
+            batcher = VideoBatcher()
+            # Пересекающиеся вызовы с повторяющимися ID
+            first = [batcher.fetch(str(i)) for i in range(60)]
+            second = [batcher.fetch(str(i)) for i in range(50, 120)]
+            results = await asyncio.gather(*first, *second)
+            await batcher.close()
+            return results
+
+        results = asyncio.run(run())
+
+        # Assert
+        self.assertEqual(len(results), 130)
+        self.assertEqual(results[0]['items'][0]['id'], '0')
+        self.assertEqual(results[-1]['items'][0]['id'], '119')
+        self.assertEqual(mock_fetch_videos_batch.call_count, 3)
+        requested = [video_id for call in mock_fetch_videos_batch.call_args_list for video_id in call.args[0]]
+        self.assertEqual(sorted(requested, key=int), [str(i) for i in range(120)])
+
+
+    @patch('youtube.fetch_videos_batch', new_callable=AsyncMock)
+    @patch('youtube.YouTubeClient.get_json', new_callable=AsyncMock)
+    def test_crawl_keywords_deduplicates_videos(self, mock_get_json, mock_fetch_videos_batch):
+        search_pages = {
+            'cats': {'items': [{'id': {'videoId': 'a'}}, {'id': {'videoId': 'b'}}]},
+            'dogs': {'items': [{'id': {'videoId': 'b'}}, {'id': {'videoId': 'c'}}]},
+        }
+        mock_get_json.side_effect = lambda url, params: search_pages[params['q']]
+        mock_fetch_videos_batch.side_effect = lambda video_ids, client, part: {
+            'items': [{'id': video_id} for video_id in video_ids]}
+
+        async def run():
+            async with YouTubeClient() as client:
+                return await crawl_keywords(['cats', 'dogs'], client)
+
+        result = asyncio.run(run())
+
+        # Assert: общее видео запрошено один раз и помечено обоими запросами
+        self.assertEqual(sorted(result), ['a', 'b', 'c'])
+        self.assertEqual(result['b']['queries'], ['cats', 'dogs'])
+        self.assertEqual(result['a']['queries'], ['cats'])
+        requested = [video_id for call in mock_fetch_videos_batch.call_args_list for video_id in call.args[0]]
+        self.assertEqual(sorted(requested), ['a', 'b', 'c'])
+
+    @patch('builtins.open', new_callable=mock_open, read_data='cats\n\n# comment\ndogs\ncats\n')
+    def test_read_keywords(self, mock_open):
+        self.assertEqual(read_keywords('keywords.txt'), ['cats', 'dogs'])
+
+    def test_stats_store_records_only_changes(self):
+        def item(video_id, views):
+            return {'id': video_id, 'snippet': {'title': 'Video', 'channelTitle': 'Channel'},
+                    'statistics': {'viewCount': str(views), 'likeCount': '1', 'commentCount': '0'}}
+
+        with tempfile.TemporaryDirectory() as tmpdir, \
+                StatsStore(os.path.join(tmpdir, 'stats.sqlite')) as store:
+            changed = store.add_videos({'a': {'items': [item('a', 10)]}, 'b': {'items': [item('b', 20)]}},
+                                       fetched_at=100)
+            self.assertEqual(changed, 2)
+            self.assertEqual(store.video_ids(), ['a', 'b'])
+
+            # Изменилась только статистика 'a'
+            changed = store.record_snapshots([item('a', 15), item('b', 20)], fetched_at=200)
+            self.assertEqual(changed, 1)
+            self.assertEqual(store.history('a'), [(100, 10, 1, 0), (200, 15, 1, 0)])
+            self.assertEqual(store.history('b'), [(100, 20, 1, 0)])
+
+    @patch('youtube.fetch_videos_batch', new_callable=AsyncMock)
+    def test_refresh_statistics_batches_statistics_only(self, mock_fetch_videos_batch):
+        mock_fetch_videos_batch.side_effect = lambda video_ids, client, part: {
+            'items': [{'id': video_id, 'statistics': {'viewCount': '5'}} for video_id in video_ids]}
+
+        with tempfile.TemporaryDirectory() as tmpdir, \
+                StatsStore(os.path.join(tmpdir, 'stats.sqlite')) as store:
+            store.add_videos({str(i): {'items': [{'id': str(i), 'statistics': {'viewCount': '1'}}]}
+                              for i in range(120)})
+
+            changed = asyncio.run(refresh_statistics(store, client=None))
+
+            # Assert
+            self.assertEqual(changed, 120)
+            self.assertEqual(mock_fetch_videos_batch.call_count, 3)
+            self.assertEqual(mock_fetch_videos_batch.call_args.kwargs['part'], 'statistics')
 
     @patch('builtins.open', new_callable=mock_open)
     @patch('csv.writer')
@@ -131,18 +569,171 @@ class TestYoutubeFunctions(unittest.TestCase):
         # Assert
         self.assertEqual(result, 'Video data is saved in testfile.csv')
         mock_open.assert_called_once_with('testfile.csv', mode='w', newline='', encoding='utf-8')
-        mock_csv_writer.return_value.writerow.assert_called_with(['Title (Название видео)', 
-                                                                  'Channel (Название канала)',
-                                                                  'Views (Количество просмотров)', 
-                                                                  'Likes (Количество лайков)', 
-                                                                  'Comments (Количество комментариев)'])
+        header = mock_csv_writer.return_value.writerow.call_args_list[0]
+        self.assertEqual(header.args[0], ['Title (Название видео)', 
+                                          'Channel (Название канала)',
+                                          'Views (Количество просмотров)', 
+                                          'Likes (Количество лайков)', 
+                                          'Comments (Количество комментариев)',
+                                          'Queries (Поисковые запросы)'])
 
         # Проверить, что была вызвана запись строки с деталями
         mock_csv_writer.return_value.writerow.assert_any_call(['Test Video', 
                                                                'Test Channel', 
                                                                '1000', 
                                                                '100', 
-                                                               '10'])
+                                                               '10',
+                                                               ''])
+
+    @patch('builtins.open', new_callable=mock_open)
+    @patch('csv.writer')
+    def test_save_to_csv_accepts_dict(self, mock_csv_writer, mock_open):
+        video_info = {'12345': {'items': [{'snippet': {'title': 'Test Video'}, 'statistics': {}}]}}
+
+        result = save_to_csv(video_info, 'testfile.csv')
+
+        # Assert: словарь из gather_video_info больше не отбрасывается
+        self.assertEqual(result, 'Video data is saved in testfile.csv')
+        self.assertEqual(mock_csv_writer.return_value.writerow.call_count, 2)
+
+    @patch('youtube.fetch_videos_batch', new_callable=AsyncMock)
+    @patch('youtube.YouTubeClient.get_json', new_callable=AsyncMock)
+    def test_run_pipeline_streams_rows(self, mock_get_json, mock_fetch_videos_batch):
+        async def search(url, params):
+            if params['q'] == 'dogs':
+                await asyncio.sleep(0.1)  # 'shared' уже записано по запросу cats
+            return {'items': [{'id': {'videoId': f"{params['q']}{i}"}} for i in range(30)]
+                    + [{'id': {'videoId': 'shared'}}]}
+
+        mock_get_json.side_effect = search
+        mock_fetch_videos_batch.side_effect = lambda video_ids, client, part: {'items': [
+            {'id': video_id, 'snippet': {'title': video_id, 'channelTitle': 'Channel'},
+             'statistics': {'viewCount': '1', 'likeCount': '2', 'commentCount': '3'}} for video_id in video_ids]}
+        columns = VideoColumns()
+
+        async def run(filename):
+            async with YouTubeClient() as client:
+                return await run_pipeline(['cats', 'dogs'], client, filename, columns=columns)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'videos.csv')
+            rows = asyncio.run(run(filename))
+            with open(filename, encoding='utf-8') as file:
+                lines = list(csv.reader(file))
+
+        # Assert: общее видео записано один раз, запрос, нашедший его позже, добавлен в столбец Queries
+        self.assertEqual(rows, 61)
+        self.assertEqual(len(lines), 62)
+        shared = [line for line in lines[1:] if line[0] == 'shared']
+        self.assertEqual(len(shared), 1)
+        self.assertEqual(shared[0][5], 'cats; dogs')
+        self.assertEqual({row['query']: row['videos'] for row in columns.by_query()}, {'cats': 31, 'dogs': 31})
+
+    def test_exporters_update_queries_of_written_rows(self):
+        def record(video_id, queries):
+            return VideoRecord.from_item({'id': video_id, 'snippet': {'title': video_id}}, queries)
+
+        formats = [('csv', {}), ('ndjson', {'compression': 'gzip'})]
+        if importlib.util.find_spec('zstandard'):
+            formats.append(('ndjson', {'compression': 'zstd'}))
+        if importlib.util.find_spec('pyarrow'):
+            formats += [('parquet', {}), ('arrow', {})]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for export_format, options in formats:
+                with self.subTest(export_format=export_format, **options):
+                    filename = os.path.join(tmpdir, f"{export_format}{options.get('compression', '')}")
+                    with make_exporter(export_format, filename, **options) as exporter:
+                        exporter.write(record('v1', ['old']))  # прежний запуск
+                    with make_exporter(export_format, filename, append=True, **options) as exporter:
+                        exporter.write(record('v1', ['cats']))
+                        exporter.write(record('v2', ['cats']))
+                    updated = exporter.update_queries({'v1': ('cats', 'dogs')})
+                    rows = self.read_queries(export_format, filename + exporter.extension
+                                             if export_format in ('csv', 'ndjson') else exporter.paths[0])
+
+                    # Assert: изменена только строка этого запуска, строки прежнего запуска не тронуты
+                    self.assertEqual(updated, 1)
+                    expected = [['cats', 'dogs'], ['cats']]
+                    if export_format in ('csv', 'ndjson'):
+                        expected = [['old']] + expected
+                    self.assertEqual(rows, expected)
+
+    @staticmethod
+    def read_queries(export_format, path):
+        if export_format == 'csv':
+            with open(path, encoding='utf-8', newline='') as file:
+                return [row[5].split('; ') for row in list(csv.reader(file))[1:]]
+        if export_format == 'ndjson':
+            if path.endswith('.zst'):
+                import zstandard
+                with open(path, 'rb') as file:
+                    reader = zstandard.ZstdDecompressor().stream_reader(file, read_across_frames=True)
+                    lines = io.TextIOWrapper(reader, encoding='utf-8').read().splitlines()
+            else:
+                with gzip.open(path, 'rt', encoding='utf-8') as file:
+                    lines = file.read().splitlines()
+            return [json.loads(line)['queries'] for line in lines]
+        import pyarrow.feather
+        import pyarrow.parquet
+        table = pyarrow.parquet.read_table(path) if export_format == 'parquet' else pyarrow.feather.read_table(path)
+        return table.column('queries').to_pylist()
+
+    def test_ndjson_exporter_append_and_partition(self):
+        details = {'items': [{'id': '12345', 'snippet': {'channelId': 'UC1', 'publishedAt': '2024-01-31T12:00:00Z'},
+                              'statistics': {'viewCount': '1000', 'likeCount': '100'}}]}
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for _ in range(2):
+                with make_exporter('ndjson', os.path.join(tmpdir, 'videos'), append=True,
+                                   partition_by_date=True) as exporter:
+                    self.assertTrue(exporter.write(details))
+                    self.assertFalse(exporter.write({}))
+
+            # Assert: оба запуска дописаны в один файл раздела по дате
+            self.assertEqual(len(exporter.paths), 1)
+            self.assertIn('date=', exporter.paths[0])
+            with gzip.open(exporter.paths[0], 'rt', encoding='utf-8') as file:
+                records = [json.loads(line) for line in file]
+        self.assertEqual(len(records), 2)
+        self.assertEqual(records[0]['view_count'], 1000)
+        self.assertIsNone(records[0]['comment_count'])
+        self.assertEqual(records[0]['published_at'], '2024-01-31T12:00:00+00:00')
+
+    def test_row_exporters_partition_by_fetch_time(self):
+        details = {'items': [{'id': '12345', 'snippet': {'title': 'v'}, 'statistics': {'viewCount': '1'}}]}
+        records = [VideoRecord.from_details(details, datetime(2024, 1, 31, 23, 59, 59, tzinfo=timezone.utc)),
+                   VideoRecord.from_details(details, datetime(2024, 2, 1, 0, 0, 1, tzinfo=timezone.utc))]
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            partitions = {}
+            for export_format in ('csv', 'ndjson'):
+                with make_exporter(export_format, os.path.join(tmpdir, export_format),
+                                   partition_by_date=True) as exporter:
+                    for record in records:
+                        exporter.write(record)
+                partitions[export_format] = [os.path.basename(os.path.dirname(path)) for path in exporter.paths]
+
+        # Assert: запуск через полночь делится на разделы по времени получения записи, а не записи в файл
+        self.assertEqual(partitions['csv'], ['date=2024-01-31', 'date=2024-02-01'])
+        self.assertEqual(partitions['ndjson'], partitions['csv'])
+
+    @unittest.skipUnless(importlib.util.find_spec('pyarrow'), 'pyarrow is not installed')
+    def test_parquet_exporter_typed_columns(self):
+        import pyarrow.parquet
+
+        details = {'items': [{'id': '12345', 'snippet': {'title': 'Test Video'},
+                              'statistics': {'viewCount': '1000', 'likeCount': '100', 'commentCount': '10'}}]}
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with make_exporter('parquet', os.path.join(tmpdir, 'videos'), row_group_size=2) as exporter:
+                for _ in range(3):
+                    exporter.write(details)
+            table = pyarrow.parquet.read_table(exporter.paths[0])
+
+        # Assert
+        self.assertEqual(table.num_rows, 3)
+        self.assertEqual(str(table.schema.field('view_count').type), 'int64')
+        self.assertEqual(table.column('comment_count').to_pylist(), [10, 10, 10])
 
     @patch('builtins.open', new_callable=mock_open)
     def test_save_to_csv_no_data(self, mock_open):
@@ -159,26 +750,205 @@ class TestYoutubeFunctions(unittest.TestCase):
     @patch('os.path.isfile', return_value=True)
     @patch('googleapiclient.discovery.build')
     @patch('googleapiclient.http.MediaFileUpload')
-    @patch('your_module.service_account.Credentials.from_service_account_file')
+    @patch('google.oauth2.service_account.Credentials.from_service_account_file')
     def test_upload_to_drive_success(self, mock_creds, mock_media_file_upload, mock_build, mock_isfile):
         # Предоставляем mock для сервиса google drive
+        get_drive_service.cache_clear()
         mock_service = MagicMock()
         mock_build.return_value = mock_service
-        mock_service.files.return_value.create.return_value.execute.return_value = {'id': '12345'}
+        mock_service.files.return_value.create.return_value.next_chunk.return_value = (None, {'id': '12345'})
 
-        # Вызов функции
+        # Вызов функции (дважды: клиент создаётся один раз)
         result = upload_to_drive('testfile.csv')
+        upload_to_drive('testfile.csv')
 
         # Assertions
         self.assertEqual(result, 'The file is uploaded to Google Drive with ID: 12345')
-        mock_isfile.assert_called_once_with('testfile.csv')
+        mock_isfile.assert_called_with('testfile.csv')
         mock_creds.assert_called_once_with(SERVICE_ACCOUNT_FILE, scopes=SCOPES)
-        mock_service.files.return_value.create.assert_called_once()
+        mock_build.assert_called_once()
+        self.assertTrue(mock_build.call_args.kwargs['static_discovery'])
+        self.assertTrue(mock_media_file_upload.call_args.kwargs['resumable'])
+        self.assertEqual(mock_service.files.return_value.create.call_count, 2)
+        get_drive_service.cache_clear()
+
+    @patch('os.path.isfile', return_value=True)
+    @patch('googleapiclient.http.MediaFileUpload')
+    @patch('youtube.get_drive_service')
+    def test_upload_to_drive_update_by_name(self, mock_get_drive_service, mock_media_file_upload, mock_isfile):
+        files = mock_get_drive_service.return_value.files.return_value
+        files.list.return_value.execute.return_value = {'files': [{'id': 'abc'}]}
+        status = MagicMock()
+        status.progress.return_value = 0.5
+        files.update.return_value.next_chunk.side_effect = [(status, None), (None, {'id': 'abc'})]
+
+        result = upload_to_drive('testfile.csv', update=True)
+
+        # Assert: содержимое существующего файла заменено, новый файл не создан
+        self.assertEqual(result, 'The file is updated on Google Drive with ID: abc')
+        files.update.assert_called_once_with(fileId='abc', media_body=mock_media_file_upload.return_value, fields='id')
+        files.create.assert_not_called()
+        self.assertEqual(files.update.return_value.next_chunk.call_count, 2)
         
+    @patch('googleapiclient.http.MediaFileUpload')
+    def test_upload_partitions_by_name_and_remove_gzip(self, mock_media_file_upload):
+        service = MagicMock()
+        files = service.files.return_value
+        files.list.return_value.execute.return_value = {'files': []}
+        files.create.return_value.next_chunk.return_value = (None, {'id': 'new'})
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            exporter = make_exporter('csv', os.path.join(tmpdir, 'videos'), partition_by_date=True)
+            paths = [exporter.path(date(2024, 1, day)) for day in (1, 2)]
+            for path in paths:
+                with open(path, 'w', encoding='utf-8') as file:
+                    file.write('id\n')
+            names = [exporter.drive_name(path) for path in paths]
+            result = upload_to_drive(paths[0], compress=True, update=True, service=service, name=names[0])
+            left = sorted(os.listdir(os.path.dirname(paths[0])))
+
+        # Assert: у партиций разных дат разные имена на Drive, временный .gz удалён после загрузки
+        self.assertEqual(names, ['date=2024-01-01_videos.csv', 'date=2024-01-02_videos.csv'])
+        self.assertEqual(result, 'The file is uploaded to Google Drive with ID: new')
+        self.assertIn("name = 'date=2024-01-01_videos.csv.gz'", files.list.call_args.kwargs['q'])
+        self.assertEqual(files.create.call_args.kwargs['body'], {'name': 'date=2024-01-01_videos.csv.gz'})
+        self.assertEqual(left, ['videos.csv'])
+
     @patch('os.path.isfile', return_value=False)
     def test_upload_to_drive_file_not_exist(self, mock_isfile):
         result = upload_to_drive('non_existing_file.csv')
         self.assertEqual(result, 'Error: File not found - non_existing_file.csv')
 
+    def test_run_pipeline_against_mock_api(self):
+        mock_api = load_mock_api()
+        api = mock_api.MockApi(results_per_query=120, error_rate=0.2, seed=1)
+
+        async def run(filename):
+            runner, url = await mock_api.serve(api)
+            try:
+                scheduler = QuotaScheduler(daily_units=10 ** 6, requests_per_second=1000, burst=1000)
+                async with YouTubeClient(scheduler=scheduler, api_root=url, retry_base_delay=0) as client:
+                    return await run_pipeline(['a', 'b'], client, max_results=120,
+                                              exporter=make_exporter('csv', filename))
+            finally:
+                await runner.cleanup()
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'videos.csv')
+            rows = asyncio.run(run(filename))
+            with open(filename, encoding='utf-8') as file:
+                lines = list(csv.reader(file))
+
+        # Assert: настоящие HTTP-запросы к локальному серверу, ошибки 5xx повторены, все страницы получены
+        self.assertEqual(rows, 240)
+        self.assertEqual(len(lines), 241)
+        self.assertGreater(sum(api.errors.values()), 0)
+        self.assertEqual(api.spent[YOUTUBE_API_KEY] // 100, 6)  # 3 страницы поиска на запрос
+
+    def test_partial_responses_and_gzip_against_mock_api(self):
+        mock_api = load_mock_api()
+        api = mock_api.MockApi()
+        fields = api_fields(make_exporter('csv', 'videos').fields)
+
+        async def run():
+            runner, url = await mock_api.serve(api)
+            try:
+                async with YouTubeClient(api_root=url, fields=fields) as client:
+                    page = await client.get_json(YOUTUBE_API_URL, {'part': 'snippet', 'q': 'a', 'maxResults': 2})
+                    videos = await fetch_videos_batch(['a-0'], client=client)
+                return page, videos
+            finally:
+                await runner.cleanup()
+
+        page, videos = asyncio.run(run())
+
+        # Assert: загружены только нужные CSV поля, ответы сжаты gzip
+        self.assertEqual(fields[VIDEO_URL], 'items(id,snippet(title,channelTitle),'
+                                            'statistics(viewCount,likeCount,commentCount))')
+        self.assertEqual(page, {'nextPageToken': '2', 'items': [{'id': {'videoId': 'a-0'}}, {'id': {'videoId': 'a-1'}}]})
+        self.assertEqual(set(videos['items'][0]['snippet']), {'title', 'channelTitle'})
+        self.assertEqual(api.requests['compressed'], 2)
+
+    def test_video_columns_reports(self):
+        def item(video_id, channel, views, likes):
+            statistics = {'viewCount': str(views), 'commentCount': '1'}
+            if likes is not None:
+                statistics['likeCount'] = str(likes)
+            return {'id': video_id, 'snippet': {'title': video_id, 'channelId': channel, 'channelTitle': channel},
+                    'statistics': statistics}
+
+        records = [VideoRecord.from_item(item('v1', 'A', 5000, 500), ['q1']),
+                   VideoRecord.from_item(item('v2', 'A', 100, 50), ['q1', 'q2']),
+                   VideoRecord.from_item(item('v3', 'B', 20000, None), ['q2']),
+                   VideoRecord.from_item(item('v4', 'B', 2000, 100), ['q2'])]
+
+        def reports():
+            columns = VideoColumns()
+            columns.extend(records)
+            return (columns.top_by_views(2), columns.top_by_like_ratio(10, min_views=1000),
+                    columns.by_channel(), columns.by_query())
+
+        with_numpy = reports()
+        with patch('youtube._load_numpy', return_value=None):
+            without_numpy = reports()
+        top_views, top_ratio, channels, queries = with_numpy
+
+        # Assert: счётчики разобраны один раз, отчёты с NumPy и без него совпадают
+        self.assertEqual(records[2].like_count, None)
+        self.assertEqual(records[1].csv_row(), ['v2', 'A', 100, 50, 1, 'q1; q2'])
+        self.assertEqual(with_numpy, without_numpy)
+        self.assertEqual([row['video_id'] for row in top_views], ['v3', 'v1'])
+        self.assertEqual([row['video_id'] for row in top_ratio], ['v1', 'v4'])
+        self.assertEqual(channels[0], {'channel_title': 'B', 'videos': 2, 'view_count': 22000, 'like_count': 100,
+                                       'comment_count': 2, 'like_view_ratio': round(100 / 22000, 6)})
+        self.assertEqual([(row['query'], row['videos'], row['view_count']) for row in queries],
+                         [('q2', 3, 22100), ('q1', 2, 5100)])
+
+    def test_channel_statistics_batched_and_cached(self):
+        mock_api = load_mock_api()
+        api = mock_api.MockApi(results_per_query=50)
+
+        async def run(filename, channel_cache):
+            runner, url = await mock_api.serve(api)
+            try:
+                async with YouTubeClient(api_root=url) as client:
+                    return await run_pipeline(['a'], client, max_results=50, channel_cache=channel_cache,
+                                              exporter=make_exporter('csv', filename, channel_stats=True))
+            finally:
+                await runner.cleanup()
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'videos.csv')
+            channel_cache = ChannelCache(os.path.join(tmpdir, 'cache.sqlite'))
+            asyncio.run(run(filename, channel_cache))
+            channel_cache.close()
+            with open(filename, encoding='utf-8') as file:
+                lines = list(csv.reader(file))
+            first_requests = api.requests['channels']
+            channel_cache = ChannelCache(os.path.join(tmpdir, 'cache.sqlite'))  # новый запуск, тот же файл
+            rows = asyncio.run(run(filename, channel_cache))
+            stats = channel_cache.stats()
+            channel_cache.close()
+
+        channels = {line[1] for line in lines[1:]}
+        # Assert: 50 видео нескольких каналов - один запрос channels.list, повторный запуск берёт каналы из кэша
+        self.assertGreater(len(channels), 1)
+        self.assertEqual(first_requests, 1)
+        self.assertEqual(api.requests['channels'], 1)
+        self.assertEqual(rows, 50)
+        self.assertEqual(stats['misses'], 0)
+        self.assertEqual(len(lines[0]), 9)
+        self.assertTrue(all(line[6].isdigit() and line[8].isdigit() for line in lines[1:]))
+
+    def test_import_is_lazy_and_side_effect_free(self):
+        code = ('import logging, sys, youtube; '
+                'print(any(name.startswith(("googleapiclient", "google.oauth2", "requests")) for name in sys.modules), '
+                'len(logging.getLogger().handlers))')
+        result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+
+        # Assert: модули Google и requests не загружены, логирование не настроено
+        self.assertEqual(result.stdout.split(), ['False', '0'])
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
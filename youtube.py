@@ -5,57 +5,269 @@ There is also a function for uploading data to Google Drive if appropriate
 access rights.
 
 Imported modules:
-- google.oauth2: Module for accessing the Google API for working with authentication and authorization via the OAuth 2.0 protocol
-- googleapiclient: A module for interacting with the Google API.
+- argparse: Module for parsing command line arguments.
 - asyncio: Python asynchronous library.
 - csv: Module for working with CSV files (writing, reading).
 - aiohttp: Library for an asynchronous HTTP client (for sending Api requests)
-- requests: Module for making HTTP requests.
-- logging: Module for logging.
+- array: Module for the compact counter columns of the reports.
+- concurrent.futures: Module for the process pool of the sharded mode.
+- dataclasses: Module for the VideoRecord model.
+- requests: Module for making HTTP requests (imported by search_youtube only).
+- functools: Module for caching the Google Drive client.
+- gzip: Module for the compressed NDJSON export and compressed uploads.
+- hashlib: Module for the names of the per-key quota files.
+- json: Module for decoding API responses and the NDJSON export.
+- logging: Module for logging (through a queue, see setup_logging).
+- queue: Module for the queue between the logging calls and the log writer thread.
 - os: Module for working with files.
+- random: Module for the jitter of the retry delays.
+- shutil: Module for copying files (compression before upload).
+- sqlite3: Module for the on-disk cache of API responses.
+- time: Module for cache timestamps.
+- datetime, zoneinfo: Modules for the typed timestamps of the exporters and the quota day.
+
+Modules imported on first use:
+- google.oauth2: Module for accessing the Google API for working with authentication and authorization via the OAuth 2.0 protocol
+- googleapiclient: A module for interacting with the Google API.
+They are slow to import and are only needed for uploads to Google Drive.
+
+Optional modules: pyarrow (Parquet and Arrow export), zstandard (zstd-compressed NDJSON),
+orjson (faster decoding of the API responses), numpy (vectorized reports).
+
+Importing the module has no side effects: logging is configured by setup_logging
+when the script is run.
 """
 
 
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
-from googleapiclient.errors import HttpError
+import argparse
 import asyncio
 import csv
 import aiohttp
-import requests
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+import dataclasses
+import functools
+import gzip
+import hashlib
+import heapq
+import io
+import json
 import logging
+import logging.handlers
+import multiprocessing
 import os
+import queue
+import random
+import shutil
+import sqlite3
+import time
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+from urllib.parse import urlencode, urlsplit
 
 
 # Constant settings for YouTube Data API
 YOUTUBE_API_KEY = 'our_youtube_api_key'  # replace with your API_KEY
 YOUTUBE_API_URL = "https://www.googleapis.com/youtube/v3/search"
 VIDEO_URL = 'https://www.googleapis.com/youtube/v3/videos'
+CHANNEL_URL = 'https://www.googleapis.com/youtube/v3/channels'
+SEARCH_PAGE_SIZE = 50  # maximum number of results on one search page
+QUERIES_MAX_CONCURRENCY = 5  # keyword searches running at the same time in batch mode
+SHARD_PROCESSES = os.cpu_count() or 1  # worker processes of the sharded mode
+VIDEOS_BATCH_SIZE = 50  # maximum number of IDs in one videos.list request
+VIDEOS_FLUSH_DELAY = 0.05  # seconds to wait for more IDs before sending an incomplete batch
+CHANNELS_BATCH_SIZE = 50  # maximum number of IDs in one channels.list request
+
+# Settings of the shared HTTP client (connection pool, DNS cache, timeouts, concurrency)
+HTTP_POOL_SIZE = 100  # total number of open connections
+HTTP_POOL_SIZE_PER_HOST = 20  # open connections to one host
+HTTP_DNS_CACHE_TTL = 300  # seconds
+HTTP_TOTAL_TIMEOUT = 60  # seconds for the whole request
+HTTP_CONNECT_TIMEOUT = 10  # seconds to get a connection from the pool and connect
+HTTP_MAX_CONCURRENCY = 20  # requests executed at the same time
+HTTP_USER_AGENT = 'youtube-search/1.0 (gzip)'  # Google APIs compress the answers only for a "gzip" User-Agent
+
+# Partial responses (fields=...): only the fields read by the module are downloaded
+SEARCH_FIELDS = 'nextPageToken,items(id/videoId)'
+VIDEO_FIELDS = {  # videos.list field of every field of the exported records
+    'video_id': 'id',
+    'channel_id': 'snippet/channelId',
+    'title': 'snippet/title',
+    'channel_title': 'snippet/channelTitle',
+    'published_at': 'snippet/publishedAt',
+    'view_count': 'statistics/viewCount',
+    'like_count': 'statistics/likeCount',
+    'comment_count': 'statistics/commentCount',
+}
+STORE_FIELDS = ('video_id', 'title', 'channel_title', 'view_count', 'like_count', 'comment_count')  # StatsStore
+CHANNEL_FIELDS = 'items(id,statistics(subscriberCount,viewCount,videoCount))'
+
+# Settings of the quota scheduler (YouTube Data API units, the quota resets at midnight Pacific time)
+QUOTA_DAILY_UNITS = 10000  # default daily quota of a Google Cloud project
+QUOTA_COSTS = {  # units charged for one request to the endpoint
+    YOUTUBE_API_URL: 100,
+    VIDEO_URL: 1,
+    CHANNEL_URL: 1,
+}
+QUOTA_REQUESTS_PER_SECOND = 10.0  # token bucket rate
+QUOTA_BURST = 20  # token bucket size
+QUOTA_LOW_WATER = 0.1  # below this share of the budget only cheap (1 unit) requests are sent
+QUOTA_STATE_FILE = 'youtube_quota.json'  # units spent today, kept between runs
+QUOTA_TIMEZONE = 'America/Los_Angeles'
+RETRY_ATTEMPTS = 5  # retries of a request after 429, 5xx or a rate limit error
+RETRY_BASE_DELAY = 1.0  # seconds, doubled on every retry, with random jitter
+RETRY_MAX_DELAY = 60.0  # seconds
+RATE_LIMIT_REASONS = {'rateLimitExceeded', 'userRateLimitExceeded'}  # 403 reasons that are retried
+QUOTA_EXCEEDED_REASONS = {'quotaExceeded', 'dailyLimitExceeded'}  # 403 reasons that stop the run
+
+# Settings of the on-disk response cache
+CACHE_FILE = 'youtube_cache.sqlite'
+CACHE_SEARCH_TTL = 6 * 60 * 60  # seconds, search results change slowly
+CACHE_STATISTICS_TTL = 15 * 60  # seconds, views/likes/comments change quickly
+CACHE_CHANNEL_TTL = 24 * 60 * 60  # seconds, channel statistics change slowly
+CACHE_MAX_BYTES = 200 * 1024 * 1024  # least recently used responses are removed above this size
+CACHE_EVICT_TARGET = 0.9  # share of max_bytes left after an eviction, the next puts do not evict again
+CACHE_ACCESS_FLUSH = 100  # access times kept in memory before they are written in one transaction
+
+# Settings of the streaming pipeline from the API requests to the CSV writer
+CSV_FILENAME = 'youtube_videos.csv'
+CSV_HEADER = ['Title (Название видео)',
+              'Channel (Название канала)',
+              'Views (Количество просмотров)',
+              'Likes (Количество лайков)',
+              'Comments (Количество комментариев)',
+              'Queries (Поисковые запросы)']
+CSV_CHANNEL_HEADER = ['Subscribers (Подписчики канала)',  # columns added by the channel enrichment
+                      'Channel views (Просмотры канала)',
+                      'Channel videos (Видео канала)']
+STREAM_QUEUE_SIZE = 1000  # records waiting for the writer
+STREAM_MAX_PENDING = 1000  # videos requested but not yet handed to the writer
+CSV_FLUSH_ROWS = 500  # the file is flushed to disk after this number of rows
+CSV_FLUSH_INTERVAL = 5.0  # ... or after this number of seconds
+
+# Settings of the exporters
+EXPORT_ROW_GROUP_SIZE = 10000  # rows buffered before a Parquet row group / Arrow record batch is written
+
+# Settings of the aggregate reports written next to the output file
+REPORT_TOP_N = 100  # rows of the top-N reports
+REPORT_MIN_VIEWS = 1000  # videos with fewer views are not ranked by the like/view ratio
+REPORT_FIELDS = ('channel_id', 'title', 'channel_title', 'view_count', 'like_count', 'comment_count')
+
+# Settings of the local store of known videos and their statistics snapshots
+STATS_STORE_FILE = 'youtube_stats.sqlite'
 
 # Constant settings for Google Drive
 # SERVICE_ACCOUNT_FILE - replace with the path to the data file (downloaded Google account in json format)
 SERVICE_ACCOUNT_FILE = 'path/to/your/credentials.json'  # example with title - project_google_api.json
 SCOPES = ['https://www.googleapis.com/auth/drive.file'] 
+DRIVE_CHUNK_SIZE = 8 * 1024 * 1024  # bytes in one chunk of a resumable upload, a multiple of 256 KiB
+DRIVE_UPLOAD_RETRIES = 5  # retries of a failed chunk, the upload continues from the last saved offset
+DRIVE_MIMETYPES = {  # content type of the uploaded files by extension
+    '.csv': 'text/csv',
+    '.ndjson': 'application/x-ndjson',
+    '.gz': 'application/gzip',
+    '.zst': 'application/zstd',
+    '.parquet': 'application/vnd.apache.parquet',
+    '.arrow': 'application/vnd.apache.arrow.file',
+}
+
+
+LOG_FILE = 'youtube.log'
+METRICS_LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # seconds, upper bounds of the histogram
+
+logger = logging.getLogger('youtube')
+trace_logger = logging.getLogger('youtube.trace')  # one JSON line per API request, see setup_logging
+
+
+def setup_logging(filename: str = LOG_FILE, trace_file: str = None) -> logging.handlers.QueueListener:
+    """Setting up logging. The data is stored in the youtube.log file with INFO logging level.
+    Called when the script is run, importing the module does not touch the log.
+    The records are put into a queue and written to the files by a QueueListener
+    thread, so the event loop never waits for the disk.
+    
+    :param filename: name of the log file.
+    :param trace_file: file of the per-request trace (JSON lines), None - no trace.
+    :return: started listener, stop() it at the end of the run to write the remaining records.
+    """
+    file_handler = logging.FileHandler(filename, encoding='utf-8')
+    file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    file_handler.addFilter(lambda record: record.name != trace_logger.name)
+    handlers = [file_handler]
+    if trace_file:
+        trace_handler = logging.FileHandler(trace_file, encoding='utf-8')
+        trace_handler.addFilter(lambda record: record.name == trace_logger.name)
+        handlers.append(trace_handler)
+        trace_logger.setLevel(logging.DEBUG)
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(logging.INFO)
+    listener = logging.handlers.QueueListener(log_queue, *handlers)
+    listener.start()
+    return listener
+
+
+class _ForwardHandler(logging.Handler):
+    """Passes the log records of the worker processes to the loggers of the parent process,
+    so they reach the handlers configured by setup_logging."""
+
+    def emit(self, record: logging.LogRecord) -> None:
+        logging.getLogger(record.name).handle(record)
+
+
+def _init_worker_logging(log_queue, trace_level: int) -> None:
+    """Initializer of the worker processes: the records are sent to the parent through the queue.
+    The handlers inherited with fork are replaced, their listener thread runs only in the parent.
+    
+    :param log_queue: multiprocessing queue read by the parent.
+    :param trace_level: level of trace_logger in the parent (DEBUG when the trace is written).
+    """
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(logging.INFO)
+    trace_logger.setLevel(trace_level)
+
 
+@functools.lru_cache(maxsize=None)
+def _json_decoder():
+    """Returns the JSON decoder of the API responses: orjson.loads when orjson
+    is installed (several times faster on large pages), json.loads otherwise.
+    """
+    try:
+        import orjson
+    except ImportError:
+        return json.loads
+    return orjson.loads
 
-# Setting up logging. The data is stored in the youtube.log file with INFO logging level.
-logging.basicConfig(
-    filename = 'youtube.log',  
-    level = logging.INFO,  
-    format = '%(asctime)s - %(levelname)s - %(message)s', 
-)
+
+def _load_drive_modules():
+    """Imports the Google Drive and authorization modules on first use.
+    They take a noticeable share of the start time and are only needed for uploads.
+    
+    :return: tuple (service_account, build, MediaFileUpload, HttpError).
+    """
+    from google.oauth2 import service_account
+    from googleapiclient.discovery import build
+    from googleapiclient.errors import HttpError
+    from googleapiclient.http import MediaFileUpload
+    return service_account, build, MediaFileUpload, HttpError
 
 
 def search_youtube(query: str, maxResults: int = 50) -> dict:
     """The function searches YouTube videos by keyword.
+    Blocking single-page version, the asynchronous pipeline uses iter_search_results.
     
     :param query: keyword for video search.
     :param maxResults: The maximum number of videos is set to 50 by default.
     :return: dictionary with information about found videos.
     """
     
-    logging.info(f'start search - {query}')
+    import requests  # only this blocking helper needs requests
+
+    logger.info(f'start search - {query}')
     
     # basic parameters for receiving data about the video
     params = {
@@ -63,203 +275,2813 @@ def search_youtube(query: str, maxResults: int = 50) -> dict:
         'q': query,
         'type': 'video',
         'key': YOUTUBE_API_KEY,
-        'maxResults': maxResults
+        'maxResults': maxResults,
+        'fields': SEARCH_FIELDS,  # only the video IDs and the next page are downloaded
     }
     try: 
-        response = requests.get(YOUTUBE_API_URL, params=params)
+        response = requests.get(YOUTUBE_API_URL, params=params,
+                                headers={'User-Agent': HTTP_USER_AGENT, 'Accept-Encoding': 'gzip'})
         return response.json()
     except requests.exceptions.HTTPError as http_err:
-        logging.error("HTTP error occurred: %s", http_err)
+        logger.error("HTTP error occurred: %s", http_err)
     except requests.exceptions.ConnectionError as conn_err:
-        logging.error("Connection error occurred: %s", conn_err)
+        logger.error("Connection error occurred: %s", conn_err)
     except requests.exceptions.Timeout as timeout_err:
-        logging.error("Request timed out: %s", timeout_err)
+        logger.error("Request timed out: %s", timeout_err)
     except requests.exceptions.RequestException as req_err:
-        logging.error("An error occurred: %s", req_err)
+        logger.error("An error occurred: %s", req_err)
+    except Exception as e:
+        logger.exception("An unexpected error occurred: %s", e)     
+    return {}
+
+
+class ResponseCache:
+    """On-disk cache of API responses stored in a SQLite file.
+    
+    The key is the endpoint plus the normalized request parameters (sorted,
+    without the API key, the id list sorted). Search results, video
+    statistics and channel statistics have separate TTLs. An expired response that has an ETag is not
+    removed: the client revalidates it with If-None-Match and reuses the stored
+    body on 304 Not Modified. When the stored bodies exceed max_bytes, the least
+    recently used responses are removed.
+    
+    Counters: hits (fresh responses), misses (absent or expired responses,
+    including the ones sent for revalidation) and revalidated (304 responses).
+    
+    Every write is committed at once, so no lock is held between the calls and
+    the file can be shared by several processes; the access times of the found
+    responses are written in batches of CACHE_ACCESS_FLUSH.
+    """
+
+    def __init__(self, filename: str = CACHE_FILE,
+                 search_ttl: float = CACHE_SEARCH_TTL,
+                 statistics_ttl: float = CACHE_STATISTICS_TTL,
+                 max_bytes: int = CACHE_MAX_BYTES,
+                 channel_ttl: float = CACHE_CHANNEL_TTL):
+        self.filename = filename
+        self.search_ttl = search_ttl
+        self.statistics_ttl = statistics_ttl
+        self.channel_ttl = channel_ttl
+        self.max_bytes = max_bytes
+        self.hits = self.misses = self.revalidated = 0
+        self._accessed = {}  # key -> access time not yet written
+
+        self._db = sqlite3.connect(filename, timeout=30)  # the sharded mode shares the file between processes
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS responses ('
+            'key TEXT PRIMARY KEY, url TEXT, etag TEXT, body TEXT, '
+            'size INTEGER, stored_at REAL, accessed_at REAL)'
+        )
+        self._db.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)')
+        self._size = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self) -> None:
+        self._flush_accessed()
+        self._db.commit()
+        self._db.close()
+
+    @staticmethod
+    def make_key(url: str, params: dict) -> str:
+        """Builds the cache key from the endpoint and the request parameters.
+        
+        :param url: endpoint address.
+        :param params: query parameters.
+        :return: cache key.
+        """
+        normalized = []
+        for name, value in params.items():
+            if name == 'key':
+                continue
+            if name == 'id':
+                value = ','.join(sorted(str(value).split(',')))
+            normalized.append((name, str(value)))
+        return f'{url}?{urlencode(sorted(normalized))}'
+
+    def ttl(self, url: str) -> float:
+        """Returns the time to live of the endpoint responses in seconds."""
+        if url == YOUTUBE_API_URL:
+            return self.search_ttl
+        return self.channel_ttl if url == CHANNEL_URL else self.statistics_ttl
+
+    def get(self, key: str):
+        """Finds a stored response.
+        
+        :param key: cache key.
+        :return: tuple (body, etag, fresh) or None if there is no response.
+        """
+        row = self._db.execute('SELECT url, etag, body, stored_at FROM responses WHERE key = ?',
+                               (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        url, etag, body, stored_at = row
+        now = time.time()
+        fresh = now - stored_at < self.ttl(url)
+        if fresh:
+            self.hits += 1
+        else:
+            self.misses += 1
+        self._accessed[key] = now
+        if len(self._accessed) >= CACHE_ACCESS_FLUSH:
+            self._flush_accessed()
+        return body, etag, fresh
+
+    def put(self, key: str, url: str, body: str, etag: str = None) -> None:
+        """Stores a response and removes the least recently used ones above max_bytes.
+        
+        :param key: cache key.
+        :param url: endpoint address, defines the TTL.
+        :param body: response body (JSON bytes or text).
+        :param etag: ETag header of the response.
+        """
+        self._flush_accessed(commit=False)  # written in the transaction of the response
+        size = len(body) if isinstance(body, bytes) else len(body.encode('utf-8'))
+        old = self._db.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+        now = time.time()
+        self._db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)',
+                         (key, url, etag, body, size, now, now))
+        self._size += size - (old[0] if old else 0)
+        if self._size > self.max_bytes:
+            self._evict()
+        self._db.commit()
+
+    def refresh(self, key: str) -> None:
+        """Marks a stored response as fresh again after a 304 Not Modified response.
+        
+        :param key: cache key.
+        """
+        self.revalidated += 1
+        now = time.time()
+        self._db.execute('UPDATE responses SET stored_at = ?, accessed_at = ? WHERE key = ?', (now, now, key))
+        self._db.commit()
+
+    def stats(self) -> dict:
+        """Returns the cache counters."""
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'revalidated': self.revalidated,
+            'hit_ratio': (self.hits + self.revalidated) / lookups if lookups else 0.0,
+            'size_bytes': self._size,
+        }
+
+    def _flush_accessed(self, commit: bool = True) -> None:
+        """Writes the access times kept in memory (used by the eviction order)."""
+        if self._accessed:
+            self._db.executemany('UPDATE responses SET accessed_at = ? WHERE key = ?',
+                                 [(accessed_at, key) for key, accessed_at in self._accessed.items()])
+            self._accessed.clear()
+            if commit:
+                self._db.commit()
+
+    def _evict(self) -> None:
+        """Removes the least recently used responses down to CACHE_EVICT_TARGET of max_bytes.
+        The oldest rows are read lazily through the accessed_at index, only as many as are removed.
+        """
+        target = int(self.max_bytes * CACHE_EVICT_TARGET)
+        keys = []
+        cursor = self._db.execute('SELECT key, size FROM responses ORDER BY accessed_at')
+        for key, size in cursor:
+            if self._size <= target:
+                break
+            keys.append((key,))
+            self._size -= size
+        cursor.close()
+        self._db.executemany('DELETE FROM responses WHERE key = ?', keys)
+
+
+class ChannelCache:
+    """Statistics of the channels kept in memory and in the channels table of a
+    SQLite file (the response cache file by default), with a TTL.
+    Unlike ResponseCache, which stores whole channels.list responses by their
+    ID lists, every channel is stored separately, so a channel requested in one
+    batch is found for any other batch and any later run.
+    
+    The statistics of a channel: {'subscriber_count', 'view_count', 'video_count'},
+    int or None when hidden.
+    """
+
+    def __init__(self, filename: str = CACHE_FILE, ttl: float = CACHE_CHANNEL_TTL):
+        """
+        :param filename: SQLite file, None - memory only.
+        :param ttl: time to live of the statistics in seconds.
+        """
+        self.ttl = ttl
+        self.hits = self.misses = 0
+        self._memory = {}  # channel_id -> (statistics, stored_at)
+        self._db = None
+        if filename:
+            self._db = sqlite3.connect(filename, timeout=30)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS channels ('
+                'channel_id TEXT PRIMARY KEY, subscriber_count INTEGER, view_count INTEGER, '
+                'video_count INTEGER, stored_at REAL)'
+            )
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.commit()
+            self._db.close()
+            self._db = None
+
+    def get(self, channel_id: str):
+        """Returns the fresh statistics of a channel, None if they are absent or expired."""
+        entry = self._memory.get(channel_id)
+        if entry is None and self._db is not None:
+            row = self._db.execute('SELECT subscriber_count, view_count, video_count, stored_at FROM channels '
+                                   'WHERE channel_id = ?', (channel_id,)).fetchone()
+            if row is not None:
+                entry = self._memory[channel_id] = (
+                    {'subscriber_count': row[0], 'view_count': row[1], 'video_count': row[2]}, row[3])
+        if entry is None or time.time() - entry[1] >= self.ttl:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[0]
+
+    def put_many(self, channels: dict) -> None:
+        """Stores the statistics {channel_id: statistics}."""
+        now = time.time()
+        for channel_id, statistics in channels.items():
+            self._memory[channel_id] = (statistics, now)
+        if self._db is not None and channels:
+            self._db.executemany(
+                'INSERT OR REPLACE INTO channels VALUES (?, ?, ?, ?, ?)',
+                [(channel_id, statistics['subscriber_count'], statistics['view_count'],
+                  statistics['video_count'], now) for channel_id, statistics in channels.items()])
+            self._db.commit()
+
+    def stats(self) -> dict:
+        """Returns the cache counters."""
+        return {'hits': self.hits, 'misses': self.misses, 'channels': len(self._memory)}
+
+
+def _parse_count(value):
+    """Converts an API counter (a string) to int, None if the counter is hidden."""
+    return int(value) if value is not None else None
+
+
+class StatsStore:
+    """Local store of the known videos and a time series of their statistics, in SQLite.
+    
+    The videos table keeps the title, the channel and the latest counters of each
+    video. A snapshot (fetch time, views, likes, comments) is appended to the
+    snapshots table only when the counters differ from the latest ones, so the
+    series grows with the number of changes, not with the number of refreshes.
+    """
+
+    def __init__(self, filename: str = STATS_STORE_FILE):
+        self.filename = filename
+        self._db = sqlite3.connect(filename)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS videos ('
+            'video_id TEXT PRIMARY KEY, title TEXT, channel_title TEXT, '
+            'views INTEGER, likes INTEGER, comments INTEGER, updated_at INTEGER)'
+        )
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS snapshots ('
+            'video_id TEXT, fetched_at INTEGER, views INTEGER, likes INTEGER, comments INTEGER, '
+            'PRIMARY KEY (video_id, fetched_at)) WITHOUT ROWID'
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self) -> None:
+        self._db.commit()
+        self._db.close()
+
+    def add_videos(self, video_info: dict, fetched_at: int = None) -> int:
+        """Adds the videos found by a search to the store and records their statistics.
+        
+        :param video_info: dictionary {video_id: details} returned by gather_video_info or crawl_keywords
+        :param fetched_at: time of the snapshot (unix seconds), now by default
+        :return: number of videos whose statistics changed.
+        """
+        items = []
+        for details in video_info.values():
+            if details.get('items'):
+                item = details['items'][0]
+                snippet = item.get('snippet', {})
+                self._db.execute(
+                    'INSERT INTO videos (video_id, title, channel_title) VALUES (?, ?, ?) '
+                    'ON CONFLICT (video_id) DO UPDATE SET title = excluded.title, '
+                    'channel_title = excluded.channel_title',
+                    (item.get('id'), snippet.get('title'), snippet.get('channelTitle')),
+                )
+                items.append(item)
+        return self.record_snapshots(items, fetched_at)
+
+    def video_ids(self) -> list:
+        """Returns the IDs of all known videos."""
+        return [row[0] for row in self._db.execute('SELECT video_id FROM videos ORDER BY video_id')]
+
+    def record_snapshots(self, items: list, fetched_at: int = None) -> int:
+        """Appends statistics snapshots for the videos whose counters have changed.
+        
+        :param items: videos.list items with the statistics part
+        :param fetched_at: time of the snapshot (unix seconds), now by default
+        :return: number of videos whose statistics changed.
+        """
+        fetched_at = int(time.time()) if fetched_at is None else fetched_at
+        changed = 0
+        for item in items:
+            video_id = item.get('id')
+            statistics = item.get('statistics', {})
+            counters = (_parse_count(statistics.get('viewCount')),
+                        _parse_count(statistics.get('likeCount')),
+                        _parse_count(statistics.get('commentCount')))
+            row = self._db.execute('SELECT views, likes, comments FROM videos WHERE video_id = ?',
+                                   (video_id,)).fetchone()
+            if row is not None and tuple(row) == counters:
+                continue
+            self._db.execute(
+                'INSERT INTO videos (video_id, views, likes, comments, updated_at) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT (video_id) DO UPDATE SET views = excluded.views, likes = excluded.likes, '
+                'comments = excluded.comments, updated_at = excluded.updated_at',
+                (video_id, *counters, fetched_at),
+            )
+            self._db.execute('INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?, ?, ?)',
+                             (video_id, fetched_at, *counters))
+            changed += 1
+        self._db.commit()
+        return changed
+
+    def history(self, video_id: str) -> list:
+        """Returns the statistics snapshots of a video.
+        
+        :param video_id: video id
+        :return: list of tuples (fetched_at, views, likes, comments) ordered by time.
+        """
+        return self._db.execute(
+            'SELECT fetched_at, views, likes, comments FROM snapshots WHERE video_id = ? ORDER BY fetched_at',
+            (video_id,),
+        ).fetchall()
+
+
+class QuotaExceeded(Exception):
+    """The daily quota budget is spent (or reserved for cheap requests), the request is not sent."""
+
+
+def _quota_day() -> str:
+    """Returns the current quota day, the API quota resets at midnight Pacific time."""
+    try:
+        return datetime.now(ZoneInfo(QUOTA_TIMEZONE)).date().isoformat()
+    except Exception:  # no time zone database
+        return datetime.now(timezone.utc).date().isoformat()
+
+
+class QuotaScheduler:
+    """Central scheduler of the API requests: quota budget and rate limit.
+    
+    Every request is charged against a daily unit budget (search = 100 units,
+    videos.list = 1) and takes a token from a per-second token bucket. When the
+    budget is spent, acquire raises QuotaExceeded instead of sending the request.
+    When less than low_water of the budget is left, expensive requests are refused
+    so the rest goes to cheap ones (details of the videos already found), and
+    cheap requests waiting for a token go before expensive ones.
+    The units spent today are kept in state_file between runs.
+    """
+
+    def __init__(self, daily_units: int = QUOTA_DAILY_UNITS,
+                 requests_per_second: float = QUOTA_REQUESTS_PER_SECOND,
+                 burst: int = QUOTA_BURST,
+                 low_water: float = QUOTA_LOW_WATER,
+                 costs: dict = None,
+                 state_file: str = None):
+        self.daily_units = daily_units
+        self.requests_per_second = requests_per_second
+        self.burst = burst
+        self.low_water = low_water
+        self.costs = dict(QUOTA_COSTS, **(costs or {}))
+        self.state_file = state_file
+        self.day = _quota_day()
+        self.spent = 0
+        self.exhausted = False
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._cheap_waiting = 0
+        self._load()
+
+    @property
+    def remaining(self) -> int:
+        """Units left in today's budget."""
+        return 0 if self.exhausted else max(0, self.daily_units - self.spent)
+
+    def cost(self, url: str) -> int:
+        """Returns the units charged for a request to the endpoint."""
+        return self.costs.get(url, 1)
+
+    async def acquire(self, url: str) -> None:
+        """Waits for a token and charges the request to the budget.
+        
+        :param url: endpoint address.
+        :raises QuotaExceeded: the budget is spent or reserved for cheap requests.
+        """
+        self._new_day()
+        cost = self.cost(url)
+        self._check_budget(url, cost)
+
+        cheap = cost <= 1
+        if cheap:
+            self._cheap_waiting += 1
+        try:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.requests_per_second)
+                self._updated = now
+                # Expensive requests let the waiting cheap ones go first
+                if self._tokens >= 1 and (cheap or not self._cheap_waiting):
+                    self._tokens -= 1
+                    break
+                await asyncio.sleep(max(1 - self._tokens, 0.1) / self.requests_per_second)
+        finally:
+            if cheap:
+                self._cheap_waiting -= 1
+
+        self._check_budget(url, cost)  # other requests may have spent the budget while waiting
+        self.spent += cost
+
+    def exhaust(self) -> None:
+        """Marks the budget as spent (the API answered quotaExceeded)."""
+        if not self.exhausted:
+            logger.warning('Quota exhausted: %d of %d units spent today', self.spent, self.daily_units)
+        self.exhausted = True
+        self.save()
+
+    def stats(self) -> dict:
+        """Returns the quota counters."""
+        return {'day': self.day, 'spent': self.spent, 'remaining': self.remaining, 'exhausted': self.exhausted}
+
+    def save(self) -> None:
+        """Saves the units spent today to the state file."""
+        if self.state_file:
+            with open(self.state_file, 'w', encoding='utf-8') as file:
+                json.dump({'day': self.day, 'spent': self.spent, 'exhausted': self.exhausted}, file)
+
+    def _load(self) -> None:
+        if not self.state_file or not os.path.isfile(self.state_file):
+            return
+        try:
+            with open(self.state_file, encoding='utf-8') as file:
+                state = json.load(file)
+        except (OSError, ValueError) as e:
+            logger.warning('Could not read the quota state %s: %s', self.state_file, e)
+            return
+        if state.get('day') == self.day:
+            self.spent = state.get('spent', 0)
+            self.exhausted = state.get('exhausted', False)
+
+    def _new_day(self) -> None:
+        day = _quota_day()
+        if day != self.day:
+            self.day, self.spent, self.exhausted = day, 0, False
+
+    def _check_budget(self, url: str, cost: int) -> None:
+        if cost > self.remaining:
+            # Only a budget that cannot pay for a cheap request is spent: the rest is left to the cheap ones
+            if cost <= 1 and not self.exhausted:
+                self.exhaust()
+            raise QuotaExceeded(f'Quota budget is spent ({self.spent} of {self.daily_units} units), '
+                                f'{url} is not requested')
+        if cost > 1 and self.remaining - cost < self.low_water * self.daily_units:
+            raise QuotaExceeded(f'Remaining {self.remaining} units are reserved for cheap requests, '
+                                f'{url} is not requested')
+
+
+def quota_state_file(api_key: str, state_file: str = QUOTA_STATE_FILE) -> str:
+    """Returns the quota state file of an API key (the key itself is not written to the name).
+    
+    :param api_key: API key.
+    :param state_file: base name of the state files.
+    :return: file name, e.g. youtube_quota-1a2b3c4d.json.
+    """
+    stem, extension = os.path.splitext(state_file)
+    return f'{stem}-{hashlib.sha1(api_key.encode()).hexdigest()[:8]}{extension}'
+
+
+class ApiKeyPool:
+    """API keys of several projects, each with its own QuotaScheduler.
+    A request uses the key with the most units left; when the budget of a key is
+    spent (or reserved for cheap requests), the next key is used.
+    """
+
+    def __init__(self, schedulers: dict):
+        """:param schedulers: dictionary {api_key: QuotaScheduler}."""
+        self.schedulers = schedulers
+
+    @classmethod
+    def from_keys(cls, api_keys: list, daily_units: int = QUOTA_DAILY_UNITS,
+                  requests_per_second: float = QUOTA_REQUESTS_PER_SECOND,
+                  state_file: str = None) -> 'ApiKeyPool':
+        """Creates a pool with a scheduler for every key.
+        
+        :param api_keys: list of API keys.
+        :param daily_units: daily budget of each key.
+        :param requests_per_second: rate limit of each key.
+        :param state_file: base name of the quota state files, None - not kept between runs.
+        :return: key pool.
+        """
+        return cls({
+            api_key: QuotaScheduler(daily_units, requests_per_second,
+                                    state_file=quota_state_file(api_key, state_file) if state_file else None)
+            for api_key in api_keys
+        })
+
+    @property
+    def exhausted(self) -> bool:
+        """True when the budgets of all keys are spent."""
+        return all(scheduler.exhausted for scheduler in self.schedulers.values())
+
+    async def acquire(self, url: str) -> str:
+        """Charges the request to the key with the most units left.
+        
+        :param url: endpoint address.
+        :return: API key for the request.
+        :raises QuotaExceeded: no key can send the request.
+        """
+        error = None
+        for api_key, scheduler in sorted(self.schedulers.items(), key=lambda item: item[1].remaining,
+                                         reverse=True):
+            try:
+                await scheduler.acquire(url)
+                return api_key
+            except QuotaExceeded as e:
+                error = e
+        raise error or QuotaExceeded('No API keys')
+
+    def exhaust(self, api_key: str) -> None:
+        """Marks the budget of a key as spent (the API answered quotaExceeded)."""
+        self.schedulers[api_key].exhaust()
+
+    def save(self) -> None:
+        """Saves the units spent today by every key."""
+        for scheduler in self.schedulers.values():
+            scheduler.save()
+
+    def stats(self) -> dict:
+        """Returns the quota counters of every key (by the end of the key)."""
+        return {f'...{api_key[-4:]}': scheduler.stats() for api_key, scheduler in self.schedulers.items()}
+
+
+class Metrics:
+    """Counters of the API requests of one run, by endpoint (search, videos, ...):
+    requests by status, a latency histogram, bytes received, quota units,
+    retries and cache hits. Saved at the end of the run in the Prometheus text
+    format or as a JSON summary; with trace_logger enabled (setup_logging with
+    trace_file) every request is also written as one JSON line.
+    """
+
+    def __init__(self, buckets: tuple = METRICS_LATENCY_BUCKETS):
+        """:param buckets: upper bounds of the latency histogram in seconds."""
+        self.buckets = tuple(buckets)
+        self.endpoints = {}
+
+    @staticmethod
+    def endpoint(url: str) -> str:
+        """Returns the endpoint name of an API address, e.g. 'search'."""
+        return urlsplit(url).path.rstrip('/').rsplit('/', 1)[-1]
+
+    def _counters(self, url: str) -> dict:
+        name = self.endpoint(url)
+        counters = self.endpoints.get(name)
+        if counters is None:
+            counters = self.endpoints[name] = {
+                'requests': {}, 'latency_buckets': [0] * (len(self.buckets) + 1), 'latency_sum': 0.0,
+                'bytes': 0, 'quota_units': 0, 'retries': 0, 'cache_hits': 0,
+            }
+        return counters
+
+    def request(self, url: str, status: int, seconds: float, size: int = 0, units: int = 0,
+                attempt: int = 0) -> None:
+        """Records an answered request.
+        
+        :param url: endpoint address.
+        :param status: HTTP status of the answer.
+        :param seconds: time from sending the request to the answer.
+        :param size: bytes of the answer body.
+        :param units: quota units charged for the request.
+        :param attempt: 0 for the first attempt, the retry number otherwise.
+        """
+        counters = self._counters(url)
+        counters['requests'][status] = counters['requests'].get(status, 0) + 1
+        index = next((i for i, bound in enumerate(self.buckets) if seconds <= bound), len(self.buckets))
+        counters['latency_buckets'][index] += 1
+        counters['latency_sum'] += seconds
+        counters['bytes'] += size
+        counters['quota_units'] += units
+        if trace_logger.isEnabledFor(logging.DEBUG):
+            trace_logger.debug(json.dumps({
+                'time': round(time.time(), 3), 'endpoint': self.endpoint(url), 'status': status,
+                'seconds': round(seconds, 4), 'bytes': size, 'units': units, 'attempt': attempt,
+            }))
+
+    def retry(self, url: str) -> None:
+        """Records a retry of a request."""
+        self._counters(url)['retries'] += 1
+
+    def cache_hit(self, url: str) -> None:
+        """Records an answer taken from the response cache (fresh or revalidated by ETag)."""
+        self._counters(url)['cache_hits'] += 1
+
+    def merge(self, summary: dict) -> None:
+        """Adds the counters of another run (to_dict() of a worker process)."""
+        for name, other in summary.items():
+            counters = self._counters(name)
+            for status, count in other['requests'].items():
+                counters['requests'][int(status)] = counters['requests'].get(int(status), 0) + count
+            counters['latency_buckets'] = [a + b for a, b in zip(counters['latency_buckets'],
+                                                                 other['latency_buckets'])]
+            for key in ('latency_sum', 'bytes', 'quota_units', 'retries', 'cache_hits'):
+                counters[key] += other[key]
+
+    def to_dict(self) -> dict:
+        """Returns the JSON summary {endpoint: counters}."""
+        return {name: dict(counters, requests={str(status): count for status, count
+                                               in sorted(counters['requests'].items())},
+                           latency_bounds=list(self.buckets))
+                for name, counters in sorted(self.endpoints.items())}
+
+    def to_prometheus(self) -> str:
+        """Returns the counters in the Prometheus text exposition format."""
+        lines = []
+
+        def metric(name: str, kind: str, text: str, samples: list) -> None:
+            lines.extend([f'# HELP {name} {text}', f'# TYPE {name} {kind}'])
+            lines.extend(f'{name}{{{labels}}} {value}' for labels, value in samples)
+
+        endpoints = sorted(self.endpoints.items())
+        metric('youtube_api_requests_total', 'counter', 'API requests by endpoint and HTTP status.',
+               [(f'endpoint="{name}",status="{status}"', count)
+                for name, counters in endpoints for status, count in sorted(counters['requests'].items())])
+        histogram = []
+        for name, counters in endpoints:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counters['latency_buckets']):
+                cumulative += count
+                histogram.append((f'endpoint="{name}",le="{bound}"', cumulative))
+        lines.extend(['# HELP youtube_api_request_duration_seconds Latency of the API requests.',
+                      '# TYPE youtube_api_request_duration_seconds histogram'])
+        lines.extend(f'youtube_api_request_duration_seconds_bucket{{{labels}}} {value}' for labels, value in histogram)
+        for name, counters in endpoints:
+            lines.append(f'youtube_api_request_duration_seconds_sum{{endpoint="{name}"}} {counters["latency_sum"]:.6f}')
+            lines.append(f'youtube_api_request_duration_seconds_count{{endpoint="{name}"}} '
+                         f'{sum(counters["latency_buckets"])}')
+        for key, text in (('bytes', 'Bytes of the API answers as transferred.'), ('quota_units', 'Quota units spent.'),
+                          ('retries', 'Retried API requests.'), ('cache_hits', 'Answers from the response cache.')):
+            metric(f'youtube_api_{key}_total', 'counter', text,
+                   [(f'endpoint="{name}"', counters[key]) for name, counters in endpoints])
+        return '\n'.join(lines) + '\n'
+
+    def save(self, filename: str) -> None:
+        """Saves the counters: JSON summary for a .json file, the Prometheus text format otherwise."""
+        with open(filename, 'w', encoding='utf-8') as file:
+            if filename.endswith('.json'):
+                json.dump(self.to_dict(), file, indent=2)
+            else:
+                file.write(self.to_prometheus())
+
+
+def api_fields(record_fields=None) -> dict:
+    """Builds the partial response selectors (the fields parameter) of the endpoints.
+    
+    :param record_fields: fields of the exported records (keys of VIDEO_FIELDS) that are
+                          needed, None - all; the fields of StatsStore are always requested.
+    :return: dictionary {endpoint address: selector},
+             e.g. {VIDEO_URL: 'items(id,snippet(title,channelTitle),statistics(viewCount))', ...}.
+    """
+    names = set(VIDEO_FIELDS if record_fields is None else record_fields) | set(STORE_FIELDS)
+    top, nested = [], {}
+    for name in VIDEO_FIELDS:  # the order of VIDEO_FIELDS keeps the selector stable for the cache
+        if name in names:
+            head, _, rest = VIDEO_FIELDS[name].partition('/')
+            if rest:
+                nested.setdefault(head, []).append(rest)
+            else:
+                top.append(head)
+    selectors = top + [f'{head}({",".join(rest)})' for head, rest in nested.items()]
+    return {YOUTUBE_API_URL: SEARCH_FIELDS, VIDEO_URL: f'items({",".join(selectors)})',
+            CHANNEL_URL: CHANNEL_FIELDS}
+
+
+def _error_reason(body: str):
+    """Returns the reason of an API error response, None if it cannot be parsed."""
+    try:
+        return _json_decoder()(body)['error']['errors'][0]['reason']
+    except (ValueError, KeyError, IndexError, TypeError):
+        return None
+
+
+def _wire_size(response: aiohttp.ClientResponse, body: bytes) -> int:
+    """Returns the bytes transferred for a response body: Content-Length when the
+    server sent it (the compressed size of a gzip response), the length of the body otherwise.
+    """
+    length = response.headers.get('Content-Length')
+    return int(length) if length and length.isdigit() else len(body)
+
+
+class YouTubeClient:
+    """A long-lived HTTP client shared by all API requests of one run.
+    
+    It owns a single aiohttp.ClientSession with a pooled keep-alive connector
+    (per-host limit, DNS cache) and timeouts, and a semaphore that bounds the
+    number of requests in flight. With a ResponseCache, fresh responses are
+    returned without a request and expired ones are revalidated by ETag.
+    Every request that is sent goes through the QuotaScheduler (or through the
+    ApiKeyPool, which picks the key); 429, 5xx and rate limit errors are retried
+    with exponential backoff and jitter. quotaExceeded moves to the next key of
+    the pool and raises QuotaExceeded when no key is left.
+    api_root sends the requests to another server with the same paths (e.g. the
+    local mock API of the benchmarks), trace_configs are passed to the session.
+    Every request, retry and cache hit is recorded in metrics.
+    Only the fields selected by fields ({endpoint address: selector}, api_fields()
+    by default, {} - whole resources) are requested, the answers are gzip-compressed
+    and decoded with orjson when it is installed.
+    Use it as an async context manager:
+    
+        async with YouTubeClient() as client:
+            video_info = await gather_video_info(video_data, client=client)
+    """
+
+    def __init__(self, api_key: str = YOUTUBE_API_KEY,
+                 pool_size: int = HTTP_POOL_SIZE,
+                 pool_size_per_host: int = HTTP_POOL_SIZE_PER_HOST,
+                 dns_cache_ttl: int = HTTP_DNS_CACHE_TTL,
+                 total_timeout: float = HTTP_TOTAL_TIMEOUT,
+                 connect_timeout: float = HTTP_CONNECT_TIMEOUT,
+                 max_concurrency: int = HTTP_MAX_CONCURRENCY,
+                 cache: ResponseCache = None,
+                 scheduler: QuotaScheduler = None,
+                 key_pool: ApiKeyPool = None,
+                 retries: int = RETRY_ATTEMPTS,
+                 retry_base_delay: float = RETRY_BASE_DELAY,
+                 retry_max_delay: float = RETRY_MAX_DELAY,
+                 api_root: str = None,
+                 trace_configs: list = None,
+                 metrics: Metrics = None,
+                 fields: dict = None):
+        self.api_key = api_key
+        self.fields = fields if fields is not None else api_fields()
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.api_root = api_root.rstrip('/') if api_root else None
+        self.trace_configs = trace_configs
+        self.cache = cache
+        self.scheduler = scheduler if scheduler is not None else QuotaScheduler()
+        self.key_pool = key_pool if key_pool is not None else ApiKeyPool({api_key: self.scheduler})
+        self.retries = retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.pool_size = pool_size
+        self.pool_size_per_host = pool_size_per_host
+        self.dns_cache_ttl = dns_cache_ttl
+        self.timeout = aiohttp.ClientTimeout(total=total_timeout, connect=connect_timeout)
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._session = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def open(self) -> None:
+        """Creates the session and its connection pool."""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                limit_per_host=self.pool_size_per_host,
+                use_dns_cache=True,
+                ttl_dns_cache=self.dns_cache_ttl,
+            )
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout,
+                                                  headers={'User-Agent': HTTP_USER_AGENT,
+                                                           'Accept-Encoding': 'gzip'},
+                                                  trace_configs=self.trace_configs)
+
+    async def close(self) -> None:
+        """Closes the session and all pooled connections."""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def get_json(self, url: str, params: dict) -> dict:
+        """Makes a GET request to the API and decodes the JSON response.
+        
+        :param url: endpoint address.
+        :param params: query parameters, the API key is added automatically.
+        :return: dictionary with the API response.
+        :raises QuotaExceeded: the quota budget is spent.
+        :raises aiohttp.ClientResponseError: the request failed after all retries.
+        """
+        if self._session is None:
+            await self.open()
+        if url in self.fields and 'fields' not in params:
+            params = dict(params, fields=self.fields[url])
+        loads = _json_decoder()
+
+        cache_key = cached = None
+        headers = {}
+        if self.cache is not None:
+            cache_key = self.cache.make_key(url, params)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                body, etag, fresh = cached
+                if fresh:
+                    self.metrics.cache_hit(url)
+                    return loads(body)
+                if etag:
+                    headers['If-None-Match'] = etag
+
+        request_url = self.api_root + urlsplit(url).path if self.api_root else url
+        attempt = 0
+        while True:
+            api_key = await self.key_pool.acquire(url)
+            units = self.key_pool.schedulers[api_key].cost(url)
+            async with self._semaphore:
+                started = time.perf_counter()
+                async with self._session.get(request_url, params=dict(params, key=api_key),
+                                             headers=headers) as response:
+                    if response.status == 304 and cached is not None:
+                        self.metrics.request(url, 304, time.perf_counter() - started, 0, units, attempt)
+                        self.metrics.cache_hit(url)
+                        self.cache.refresh(cache_key)
+                        return loads(cached[0])
+                    if response.status < 400:
+                        body = await response.read()  # bytes, both decoders accept them
+                        etag = response.headers.get('ETag')
+                        self.metrics.request(url, response.status, time.perf_counter() - started,
+                                             _wire_size(response, body), units, attempt)
+                        break
+
+                    error_body = await response.read()
+                    self.metrics.request(url, response.status, time.perf_counter() - started,
+                                         _wire_size(response, error_body), units, attempt)
+                    reason = _error_reason(error_body) if response.status == 403 else None
+                    if reason in QUOTA_EXCEEDED_REASONS:
+                        self.key_pool.exhaust(api_key)
+                        if self.key_pool.exhausted:
+                            raise QuotaExceeded(f'The API answered {reason} for {url}')
+                        continue  # the next key of the pool
+                    retriable = (response.status == 429 or response.status >= 500
+                                 or reason in RATE_LIMIT_REASONS)
+                    if not retriable or attempt >= self.retries:
+                        response.raise_for_status()
+                    retry_after = response.headers.get('Retry-After')
+
+            # Exponential backoff with full jitter, Retry-After is respected when given
+            delay = random.uniform(0, min(self.retry_max_delay, self.retry_base_delay * 2 ** attempt))
+            if retry_after and retry_after.isdigit():
+                delay = max(delay, float(retry_after))
+            attempt += 1
+            self.metrics.retry(url)
+            logger.warning('%s answered %s, retry %d of %d in %.1f s', url, response.status, attempt,
+                           self.retries, delay)
+            await asyncio.sleep(delay)
+
+        if self.cache is not None:
+            self.cache.put(cache_key, url, body, etag)
+        return loads(body)
+
+
+async def fetch_search_page(query: str, client: YouTubeClient, page_size: int = SEARCH_PAGE_SIZE,
+                            page_token: str = None) -> dict:
+    """An asynchronous function that gets one page of YouTube search results.
+    
+    :param query: keyword for video search.
+    :param client: shared HTTP client.
+    :param page_size: number of results on the page (no more than SEARCH_PAGE_SIZE).
+    :param page_token: nextPageToken of the previous page, None for the first page.
+    :return: dictionary with the search page, {} on error.
+    """
+    
+    params = {
+        'part': 'snippet',
+        'q': query,
+        'type': 'video',
+        'maxResults': page_size,
+    }
+    if page_token:
+        params['pageToken'] = page_token
+    try:
+        return await client.get_json(YOUTUBE_API_URL, params)
+    except QuotaExceeded as quota_err:
+        logger.warning("Search stopped: %s", quota_err)
+    except aiohttp.ClientResponseError as http_err:
+        logger.error("HTTP error occurred: %s", http_err)
+    except aiohttp.ClientConnectionError as conn_err:
+        logger.error("Connection error occurred: %s", conn_err)
+    except asyncio.TimeoutError as timeout_err:
+        logger.error("Request timed out: %s", timeout_err)
+    except aiohttp.ClientError as client_err:
+        logger.error("A client error occurred: %s", client_err)
     except Exception as e:
-        logging.exception("An unexpected error occurred: %s", e)     
+        logger.exception("An unexpected error occurred: %s", e)
+    
     return {}
 
 
-async def fetch_video_details(video_id: str) -> dict:
+async def iter_search_results(query: str, client: YouTubeClient, max_results: int = SEARCH_PAGE_SIZE,
+                              max_pages: int = None):
+    """An asynchronous generator that searches YouTube videos by keyword and yields
+    the found items page by page, following nextPageToken.
+    The next page is requested before the items of the current one are handed out,
+    so processing of one page overlaps with downloading the next.
+    
+    :param query: keyword for video search.
+    :param client: shared HTTP client.
+    :param max_results: total number of results, None - no limit.
+    :param max_pages: number of pages, None - no limit.
+    :return: search result items (the same as in the 'items' list of search_youtube).
+    """
+    
+    logger.info(f'start search - {query}')
+
+    def page_size(fetched: int) -> int:
+        if max_results is None:
+            return SEARCH_PAGE_SIZE
+        return min(SEARCH_PAGE_SIZE, max_results - fetched)
+
+    fetched = pages = 0
+    page_task = None
+    if page_size(fetched) > 0 and (max_pages is None or max_pages > 0):
+        page_task = asyncio.ensure_future(fetch_search_page(query, client, page_size(fetched)))
+    try:
+        while page_task is not None:
+            page = await page_task
+            page_task = None
+            pages += 1
+
+            items = page.get('items', [])
+            if max_results is not None:
+                items = items[:max_results - fetched]
+            fetched += len(items)
+
+            # Requesting the next page before handing out the current one
+            page_token = page.get('nextPageToken')
+            if (page_token and items and page_size(fetched) > 0
+                    and (max_pages is None or pages < max_pages)):
+                page_task = asyncio.ensure_future(
+                    fetch_search_page(query, client, page_size(fetched), page_token))
+
+            for item in items:
+                yield item
+    finally:
+        if page_task is not None:
+            page_task.cancel()
+
+    logger.info('search %s finished - %d results, %d pages', query, fetched, pages)
+
+
+async def fetch_videos_batch(video_ids: list, client: YouTubeClient = None,
+                             part: str = 'statistics,snippet') -> dict:
+    """An asynchronous function that gets details for several videos with a single
+    videos.list request (the API accepts up to 50 comma-separated IDs).
+    
+    :param video_ids: list of video ids (no more than VIDEOS_BATCH_SIZE).
+    :param client: shared HTTP client, a temporary one is opened if not given.
+    :param part: resource parts requested from the API.
+    :return: dictionary with the API response, the videos are in the 'items' list.
+    """
+    
+    logger.debug('start function fetch_videos_batch - %d ids', len(video_ids))
+    params = {
+        'part': part,
+        'id': ','.join(video_ids),
+    }
+    try: 
+        if client is None:
+            async with YouTubeClient() as client:
+                return await client.get_json(VIDEO_URL, params)
+        return await client.get_json(VIDEO_URL, params)
+    except QuotaExceeded as quota_err:
+        logger.warning("Video details not requested: %s", quota_err)
+    except aiohttp.ClientResponseError as http_err:
+        logger.error("HTTP error occurred: %s", http_err)
+    except aiohttp.ClientConnectionError as conn_err:
+        logger.error("Connection error occurred: %s", conn_err)
+    except asyncio.TimeoutError as timeout_err:
+        logger.error("Request timed out: %s", timeout_err)
+    except aiohttp.ClientError as client_err:
+        logger.error("A client error occurred: %s", client_err)
+    except Exception as e:
+        logger.exception("An unexpected error occurred: %s", e)
+    
+    return {}
+
+
+async def fetch_video_details(video_id: str, client: YouTubeClient = None) -> dict:
     """An asynchronous function that gets video details by its ID.
     
     :param video_id: video id for obtaining data for this video.
+    :param client: shared HTTP client, a temporary one is opened if not given.
     :return: dictionary with extended information about the video.
     """
     
-    logging.info(f'start function fetch_video_details')
-    video_details_url = f'{VIDEO_URL}?part=statistics,snippet&id={video_id}&key={YOUTUBE_API_KEY}'
+    return await fetch_videos_batch([video_id], client=client)
+
+
+class VideoBatcher:
+    """Collects the video IDs requested by concurrent callers and gets them with
+    videos.list requests of up to max_batch_size IDs each.
+    
+    An ID is sent when the batch is full or when flush_delay seconds have passed
+    since the first pending ID, so overlapping callers share the same requests.
+    Each caller receives its own video in the {'items': [item]} format of the
+    single-video response ({} if the video was not found).
+    """
+
+    def __init__(self, client: YouTubeClient = None,
+                 max_batch_size: int = VIDEOS_BATCH_SIZE,
+                 flush_delay: float = VIDEOS_FLUSH_DELAY,
+                 part: str = 'statistics,snippet'):
+        self.client = client
+        self.max_batch_size = max(1, min(max_batch_size, VIDEOS_BATCH_SIZE))
+        self.flush_delay = flush_delay
+        self.part = part
+        self._pending = {}  # video_id -> future, waiting for the next batch
+        self._inflight = {}  # video_id -> future, the batch has already been sent
+        self._timer = None
+        self._tasks = set()
+
+    async def fetch(self, video_id: str) -> dict:
+        """Queues the video ID for the next batch and waits for its details.
+        
+        :param video_id: video id for obtaining data for this video.
+        :return: dictionary with information about the video.
+        """
+        future = self._pending.get(video_id) or self._inflight.get(video_id)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._pending[video_id] = future
+            if len(self._pending) >= self.max_batch_size:
+                self.flush()
+            elif self._timer is None:
+                self._timer = loop.call_later(self.flush_delay, self.flush)
+        # shield: a cancelled caller must not cancel the result shared with others
+        return await asyncio.shield(future)
+
+    def flush(self) -> None:
+        """Sends all pending IDs without waiting for the flush delay."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        self._inflight.update(batch)
+        task = asyncio.ensure_future(self._send(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def close(self) -> None:
+        """Sends the remaining IDs and waits for all requests to finish."""
+        self.flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _request(self, ids: list) -> dict:
+        return await fetch_videos_batch(ids, client=self.client, part=self.part)
+
+    def _result(self, video_id: str, item):
+        if item is None:
+            logger.warning("No details returned for video: %s", video_id)
+        return {'items': [item]} if item else {}
+
+    async def _send(self, batch: dict) -> None:
+        try:
+            response = await self._request(list(batch))
+        except Exception as e:
+            for video_id, future in batch.items():
+                self._inflight.pop(video_id, None)
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        items = {item.get('id'): item for item in response.get('items', [])}
+        for video_id, future in batch.items():
+            self._inflight.pop(video_id, None)
+            result = self._result(video_id, items.get(video_id))
+            if not future.done():
+                future.set_result(result)
+
+
+async def fetch_channels_batch(channel_ids: list, client: YouTubeClient = None) -> dict:
+    """An asynchronous function that gets the statistics of several channels with a single
+    channels.list request (the API accepts up to 50 comma-separated IDs).
+    
+    :param channel_ids: list of channel ids (no more than CHANNELS_BATCH_SIZE).
+    :param client: shared HTTP client, a temporary one is opened if not given.
+    :return: dictionary with the API response, the channels are in the 'items' list.
+    """
+    
+    logger.debug('start function fetch_channels_batch - %d ids', len(channel_ids))
+    params = {
+        'part': 'statistics',
+        'id': ','.join(channel_ids),
+    }
     try: 
-        async with aiohttp.ClientSession() as session:
-            async with session.get(video_details_url) as response:
-                return await response.json()
+        if client is None:
+            async with YouTubeClient() as client:
+                return await client.get_json(CHANNEL_URL, params)
+        return await client.get_json(CHANNEL_URL, params)
+    except QuotaExceeded as quota_err:
+        logger.warning("Channel statistics not requested: %s", quota_err)
     except aiohttp.ClientResponseError as http_err:
-        logging.error("HTTP error occurred: %s", http_err)
+        logger.error("HTTP error occurred: %s", http_err)
     except aiohttp.ClientConnectionError as conn_err:
-        logging.error("Connection error occurred: %s", conn_err)
-    except aiohttp.ClientTimeout as timeout_err:
-        logging.error("Request timed out: %s", timeout_err)
+        logger.error("Connection error occurred: %s", conn_err)
+    except asyncio.TimeoutError as timeout_err:
+        logger.error("Request timed out: %s", timeout_err)
     except aiohttp.ClientError as client_err:
-        logging.error("A client error occurred: %s", client_err)
+        logger.error("A client error occurred: %s", client_err)
     except Exception as e:
-        logging.exception("An unexpected error occurred: %s", e)
+        logger.exception("An unexpected error occurred: %s", e)
     
     return {}
 
 
-async def gather_video_info(video_data: dict) -> dict:
+def _channel_statistics(item: dict) -> dict:
+    """Converts a channels.list item to the channel statistics of ChannelCache."""
+    statistics = item.get('statistics', {})
+    return {
+        'subscriber_count': _parse_count(statistics.get('subscriberCount')),
+        'view_count': _parse_count(statistics.get('viewCount')),
+        'video_count': _parse_count(statistics.get('videoCount')),
+    }
+
+
+class ChannelBatcher(VideoBatcher):
+    """VideoBatcher for channels.list: the channel IDs requested by concurrent
+    callers are sent in requests of up to 50 IDs. Channels found in the
+    ChannelCache are not requested, the received ones are added to it, so every
+    channel is requested at most once per TTL however many videos it has.
+    Each caller receives the channel statistics ({} if the channel was not found).
+    """
+
+    def __init__(self, client: YouTubeClient = None, cache: ChannelCache = None,
+                 max_batch_size: int = CHANNELS_BATCH_SIZE,
+                 flush_delay: float = VIDEOS_FLUSH_DELAY):
+        super().__init__(client, max_batch_size, flush_delay, part='statistics')
+        self.cache = cache if cache is not None else ChannelCache(None)
+
+    async def fetch(self, channel_id: str) -> dict:
+        """Returns the statistics of the channel from the cache or from the next batch."""
+        statistics = self.cache.get(channel_id)
+        if statistics is not None:
+            return statistics
+        return await super().fetch(channel_id)
+
+    async def _request(self, ids: list) -> dict:
+        response = await fetch_channels_batch(ids, client=self.client)
+        self.cache.put_many({item.get('id'): _channel_statistics(item) for item in response.get('items', [])})
+        return response
+
+    def _result(self, channel_id: str, item):
+        if item is None:
+            logger.warning("No statistics returned for channel: %s", channel_id)
+            return {}
+        return _channel_statistics(item)
+
+
+async def _iter_items(video_data):
+    """Yields the found videos from a search dictionary or an asynchronous iterator."""
+    if isinstance(video_data, dict):
+        for item in video_data.get('items', []):
+            yield item
+    else:
+        async for item in video_data:
+            yield item
+
+
+async def gather_video_info(video_data, client: YouTubeClient = None,
+                            batcher: VideoBatcher = None) -> dict:
     """An asynchronous function that collects information about each video for further recording.
-    It loops through each video, finds the id and gets it through the fetch_video_details function
-    extended data necessary for further recording (processing)
+    It loops through each video, finds the id and gets it through the VideoBatcher
+    (videos.list requests of up to 50 IDs) extended data necessary for further recording (processing).
+    Details are requested as soon as a video arrives, so with iter_search_results
+    they are fetched while the next search pages are being downloaded.
     
-    :param video_data: dictionary of found videos
+    :param video_data: dictionary of found videos or asynchronous iterator of found items
+    :param client: shared HTTP client used when a new batcher is created
+    :param batcher: batcher shared with other callers, a new one is created by default
     :return: dictionary with extended information about the video.
     """
-    logging.info('Start gather_video_info')
+    logger.info('Start gather_video_info')
     
-    tasks = []
-    for item in video_data.get('items', []):
-        video_id = item.get('id', {}).get('videoId')
-        if video_id:
-            tasks.append(fetch_video_details(video_id))
-        else:
-            logging.warning("No video ID found for item: %s", item)
+    own_batcher = batcher is None
+    if own_batcher:
+        batcher = VideoBatcher(client)
 
+    video_ids = []
+    tasks = []
     try:
+        async for item in _iter_items(video_data):
+            video_id = item.get('id', {}).get('videoId')
+            if video_id:
+                video_ids.append(video_id)
+                tasks.append(asyncio.ensure_future(batcher.fetch(video_id)))
+            else:
+                logger.warning("No video ID found for item: %s", item)
+
         video_details = await asyncio.gather(*tasks, return_exceptions=True)
         # Filter out any exceptions and log them
         for detail in video_details:
             if isinstance(detail, Exception):
-                logging.error("Error fetching video details: %s", detail)
-        return {video['id']: detail for video, detail in zip(video_data['items'], video_details) if not isinstance(detail, Exception)}
+                logger.error("Error fetching video details: %s", detail)
+        return {video_id: detail for video_id, detail in zip(video_ids, video_details) if not isinstance(detail, Exception)}
 
     except Exception as e:
-        logging.error("An unexpected error occurred: %s", e)
+        logger.error("An unexpected error occurred: %s", e)
+        for task in tasks:
+            task.cancel()
         return {}
+    finally:
+        if own_batcher:
+            await batcher.close()
+
+
+def _channel_id(details: dict):
+    """Returns the channel ID of the details of one video, None if it is unknown."""
+    if not details.get('items'):
+        return None
+    return details['items'][0].get('snippet', {}).get('channelId')
+
+
+async def enrich_channels(video_info: dict, client: YouTubeClient = None, cache: ChannelCache = None,
+                          batcher: ChannelBatcher = None) -> int:
+    """An asynchronous function that joins the channel statistics onto the video details
+    (details['channel']) collected by gather_video_info or crawl_keywords.
+    Only the distinct channel IDs are requested, with channels.list requests of up
+    to 50 IDs; channels in the cache are not requested at all.
+    
+    :param video_info: dictionary {video_id: details}, changed in place
+    :param client: shared HTTP client used when a new batcher is created
+    :param cache: channel cache used when a new batcher is created, memory only by default
+    :param batcher: batcher shared with other callers, a new one is created by default
+    :return: number of distinct channels.
+    """
+    channel_ids = list(dict.fromkeys(filter(None, map(_channel_id, video_info.values()))))
+    logger.info('Start enrich_channels - %d videos, %d channels', len(video_info), len(channel_ids))
+    
+    own_batcher = batcher is None
+    if own_batcher:
+        batcher = ChannelBatcher(client, cache)
+    try:
+        results = await asyncio.gather(*(batcher.fetch(channel_id) for channel_id in channel_ids),
+                                       return_exceptions=True)
+    finally:
+        if own_batcher:
+            await batcher.close()
+    
+    channels = {}
+    for channel_id, result in zip(channel_ids, results):
+        if isinstance(result, Exception):
+            logger.error("Error fetching channel statistics: %s", result)
+        else:
+            channels[channel_id] = result
+    for details in video_info.values():
+        channel_id = _channel_id(details)
+        if channel_id in channels:
+            details['channel'] = channels[channel_id]
+    return len(channel_ids)
+
+
+def read_keywords(filename: str) -> list:
+    """Reads search keywords from a text file, one keyword per line.
+    Empty lines and lines starting with # are skipped, repeated keywords are removed.
+    
+    :param filename: name of the file with keywords
+    :return: list of keywords in the file order.
+    """
+    with open(filename, encoding='utf-8') as file:
+        keywords = [line.strip() for line in file]
+    return list(dict.fromkeys(keyword for keyword in keywords if keyword and not keyword.startswith('#')))
+
+
+async def _crawl(queries: list, client: YouTubeClient, emit, max_results: int = SEARCH_PAGE_SIZE,
+                 max_concurrency: int = QUERIES_MAX_CONCURRENCY, max_pending: int = None) -> dict:
+    """Search and fetch loop shared by crawl_keywords and stream_video_info.
+    All searches share one set of video IDs and one VideoBatcher; emit(video_id, details)
+    is awaited for every unique video as soon as its details arrive.
+    details['queries'] is the list of keywords that found the video, it keeps growing
+    while the searches go on.
+    
+    :param max_pending: number of videos requested but not yet emitted, the searches
+                        wait when it is reached. None - no limit.
+    :return: dictionary {video_id: keywords that found the video} after all searches.
+    """
+    query_semaphore = asyncio.Semaphore(max_concurrency)
+    pending_slots = asyncio.Semaphore(max_pending) if max_pending else None
+    batcher = VideoBatcher(client)
+    matched_queries = {}  # video_id -> keywords that found the video
+    pending = set()  # details requests that have not been emitted yet
+
+    async def fetch(video_id: str) -> None:
+        try:
+            details = await batcher.fetch(video_id)
+            await emit(video_id, dict(details, queries=matched_queries[video_id]))
+        except Exception as e:
+            logger.error("Error fetching video details: %s", e)
+        finally:
+            if pending_slots is not None:
+                pending_slots.release()
+
+    async def search(query: str) -> None:
+        async with query_semaphore:
+            async for item in iter_search_results(query, client, max_results=max_results):
+                video_id = item.get('id', {}).get('videoId')
+                if not video_id:
+                    logger.warning("No video ID found for item: %s", item)
+                    continue
+                queries_found = matched_queries.get(video_id)
+                if queries_found is None:
+                    # The first time the video is seen - one details request for all keywords
+                    matched_queries[video_id] = [query]
+                    if pending_slots is not None:
+                        await pending_slots.acquire()
+                    task = asyncio.ensure_future(fetch(video_id))
+                    pending.add(task)
+                    task.add_done_callback(pending.discard)
+                elif query not in queries_found:
+                    queries_found.append(query)
+
+    try:
+        search_results = await asyncio.gather(*(search(query) for query in queries), return_exceptions=True)
+        for query, result in zip(queries, search_results):
+            if isinstance(result, Exception):
+                logger.error("Error searching for %s: %s", query, result)
+        if pending:
+            await asyncio.gather(*pending)
+    finally:
+        await batcher.close()
+    return matched_queries
+
+
+async def crawl_keywords(queries: list, client: YouTubeClient, max_results: int = SEARCH_PAGE_SIZE,
+                         max_concurrency: int = QUERIES_MAX_CONCURRENCY) -> dict:
+    """An asynchronous function that searches several keywords concurrently and collects
+    information about the found videos.
+    All searches share one set of video IDs and one VideoBatcher, so a video found
+    by several keywords has its details requested only once.
+    
+    :param queries: list of keywords for video search
+    :param client: shared HTTP client, its semaphore caps the requests of all searches
+    :param max_results: number of search results for each keyword
+    :param max_concurrency: number of keywords searched at the same time
+    :return: dictionary {video_id: details}, details['queries'] lists the keywords that found the video.
+    """
+    logger.info('Start crawl_keywords - %d queries', len(queries))
+
+    video_info = {}
+
+    async def collect(video_id: str, details: dict) -> None:
+        video_info[video_id] = details
+
+    await _crawl(queries, client, collect, max_results=max_results, max_concurrency=max_concurrency)
+
+    logger.info('crawl_keywords finished - %d unique videos', len(video_info))
+    return video_info
+
+
+async def stream_video_info(queries: list, client: YouTubeClient, queue: asyncio.Queue,
+                            max_results: int = SEARCH_PAGE_SIZE,
+                            max_concurrency: int = QUERIES_MAX_CONCURRENCY,
+                            store: StatsStore = None, channels: ChannelBatcher = None) -> dict:
+    """An asynchronous function that searches the keywords like crawl_keywords but does not
+    keep the results: the VideoRecord of every unique video is put into the queue as soon
+    as its details arrive. A full queue holds up the searches, so memory use does not depend
+    on the number of videos.
+    Keywords that find a video after it has been put into the queue are returned at the end,
+    the writer adds them to the written rows in a second pass (Exporter.update_queries).
+    With channels, the statistics of the video channel are joined onto the record first
+    (the channel IDs of concurrent videos share channels.list requests).
+    
+    :param queries: list of keywords for video search
+    :param client: shared HTTP client
+    :param queue: bounded queue read by the writer (write_stream)
+    :param max_results: number of search results for each keyword
+    :param max_concurrency: number of keywords searched at the same time
+    :param store: store of the known videos for the refresh mode, None - not stored.
+    :param channels: batcher of the channel statistics, None - no channel statistics.
+    :return: dictionary {video_id: all keywords} of the videos found by more keywords than
+             their queued records have.
+    """
+    logger.info('Start stream_video_info - %d queries', len(queries))
+    queued = {}  # video_id -> number of keywords in the queued record
+
+    async def put(video_id: str, details: dict) -> None:
+        if store is not None:
+            store.add_videos({video_id: details})
+        channel_id = _channel_id(details)
+        if channels is not None and channel_id:
+            details = dict(details, channel=await channels.fetch(channel_id))
+        record = VideoRecord.from_details(details)  # parsed once, the API dictionaries are dropped
+        if record is not None:
+            queued[video_id] = len(record.queries)
+            await queue.put(record)
+
+    matched_queries = await _crawl(queries, client, put, max_results=max_results,
+                                   max_concurrency=max_concurrency, max_pending=STREAM_MAX_PENDING)
+    late = {video_id: tuple(matched_queries[video_id]) for video_id, count in queued.items()
+            if len(matched_queries[video_id]) > count}
+    logger.info('stream_video_info finished - %d videos, %d found again later', len(queued), len(late))
+    return late
+
+
+async def refresh_statistics(store: StatsStore, client: YouTubeClient,
+                             batch_size: int = VIDEOS_BATCH_SIZE) -> int:
+    """An asynchronous function that re-polls the statistics of the known videos.
+    Only part=statistics is requested, in videos.list batches of up to 50 IDs,
+    and a snapshot is stored only for the videos whose counters changed.
+    
+    :param store: store of the known videos
+    :param client: shared HTTP client
+    :param batch_size: number of IDs in one request (no more than VIDEOS_BATCH_SIZE)
+    :return: number of videos whose statistics changed.
+    """
+    video_ids = store.video_ids()
+    logger.info('Start refresh_statistics - %d videos', len(video_ids))
+
+    batch_size = max(1, min(batch_size, VIDEOS_BATCH_SIZE))
+    batches = [video_ids[i:i + batch_size] for i in range(0, len(video_ids), batch_size)]
+    fetched_at = int(time.time())
+    changed = 0
+    # Each batch is stored as soon as it arrives, nothing is accumulated in memory
+    for future in asyncio.as_completed([fetch_videos_batch(batch, client=client, part='statistics')
+                                        for batch in batches]):
+        response = await future
+        changed += store.record_snapshots(response.get('items', []), fetched_at)
+
+    logger.info('refresh_statistics finished - %d videos changed', changed)
+    return changed
+
+
+def _shard_keys(key_pool: ApiKeyPool, shards: int) -> list:
+    """Splits the API keys and their remaining budgets between the worker processes.
+    With enough keys every worker gets its own keys; otherwise the workers sharing
+    a key get equal parts of its remaining units and of its rate limit.
+    
+    :return: list (one item per worker) of lists of tuples (api_key, units, requests_per_second).
+    """
+    keys = list(key_pool.schedulers.items())
+    if len(keys) >= shards:
+        return [[(api_key, scheduler.remaining, scheduler.requests_per_second)
+                 for api_key, scheduler in keys[i::shards]] for i in range(shards)]
+    sharing = [len(range(j, shards, len(keys))) for j in range(len(keys))]
+    result = []
+    for i in range(shards):
+        j = i % len(keys)
+        api_key, scheduler = keys[j]
+        result.append([(api_key, scheduler.remaining // sharing[j], scheduler.requests_per_second / sharing[j])])
+    return result
+
+
+async def _run_shard_async(task: str, items: list, keys: list, options: dict):
+    key_pool = ApiKeyPool({api_key: QuotaScheduler(units, requests_per_second)
+                           for api_key, units, requests_per_second in keys})
+    cache = ResponseCache(options['cache_file']) if options.get('cache_file') else None
+    metrics = Metrics()
+    try:
+        async with YouTubeClient(cache=cache, key_pool=key_pool, metrics=metrics,
+                                 fields=options.get('fields')) as client:
+            if task == 'search':
+                semaphore = asyncio.Semaphore(options['max_concurrency'])
+
+                async def search(query: str) -> list:
+                    async with semaphore:
+                        return [item['id']['videoId']
+                                async for item in iter_search_results(query, client, max_results=options['max_results'])
+                                if item.get('id', {}).get('videoId')]
+
+                found = await asyncio.gather(*(search(query) for query in items))
+                result = dict(zip(items, found))
+            else:
+                batches = [items[i:i + VIDEOS_BATCH_SIZE] for i in range(0, len(items), VIDEOS_BATCH_SIZE)]
+                responses = await asyncio.gather(*(fetch_videos_batch(batch, client=client) for batch in batches))
+                result = [item for response in responses for item in response.get('items', [])]
+    finally:
+        if cache is not None:
+            cache.close()
+    return result, {api_key: (scheduler.spent, scheduler.exhausted)
+                    for api_key, scheduler in key_pool.schedulers.items()}, metrics.to_dict()
+
+
+def _run_shard(task: str, items: list, keys: list, options: dict):
+    """Entry point of a worker process: runs one shard in its own event loop.
+    
+    :param task: 'search' (items are keywords) or 'details' (items are video IDs).
+    :param items: keywords or video IDs of the shard.
+    :param keys: API keys of the worker with their units and rate limits.
+    :param options: max_results, max_concurrency, cache_file, fields.
+    :return: tuple (result, {api_key: (units spent, exhausted)}, Metrics.to_dict()); the result is
+             {query: [video_id]} for 'search' and the list of videos.list items for 'details'.
+    """
+    return asyncio.run(_run_shard_async(task, items, keys, options))
+
+
+def _run_phase(executor: ProcessPoolExecutor, task: str, shards: list, key_pool: ApiKeyPool,
+               options: dict, metrics: Metrics = None) -> list:
+    """Runs the shards in the worker processes, charges their units to the key pool
+    and adds their request counters to the metrics.
+    
+    :return: results of the shards in the shard order.
+    """
+    shards = [shard for shard in shards if shard]
+    if not shards:
+        return []
+    keys = _shard_keys(key_pool, len(shards))
+    futures = [executor.submit(_run_shard, task, shard, shard_keys, options)
+               for shard, shard_keys in zip(shards, keys)]
+    results = []
+    for future in futures:
+        result, spent, summary = future.result()
+        if metrics is not None:
+            metrics.merge(summary)
+        for api_key, (units, exhausted) in spent.items():
+            scheduler = key_pool.schedulers[api_key]
+            scheduler.spent += units
+            if exhausted and scheduler.remaining:  # the API answered quotaExceeded in the worker
+                scheduler.exhaust()
+        results.append(result)
+    return results
 
 
-def save_to_csv(video_details: dict, filename: str) -> str:
+def crawl_sharded(queries: list, key_pool: ApiKeyPool, processes: int = SHARD_PROCESSES,
+                  max_results: int = SEARCH_PAGE_SIZE, max_concurrency: int = QUERIES_MAX_CONCURRENCY,
+                  cache_file: str = None, metrics: Metrics = None, fields: dict = None) -> dict:
+    """Searches the keywords in a pool of worker processes, each running its own event loop.
+    
+    The work is done in two phases: the keywords are split between the workers and
+    searched, then the parent merges the found video IDs in the keyword order and
+    removes the duplicates, and the unique IDs are split between the workers
+    for the videos.list requests (JSON decoding is done in the workers).
+    Every API key has its own quota accounting.
+    
+    :param queries: list of keywords for video search
+    :param key_pool: API keys with their quota schedulers
+    :param processes: number of worker processes
+    :param max_results: number of search results for each keyword
+    :param max_concurrency: number of keywords searched at the same time in each worker
+    :param cache_file: on-disk response cache shared by the workers, None - no cache
+    :param metrics: request counters, the counters of the workers are added to them
+    :param fields: partial response selectors of the endpoints, api_fields() by default
+    :return: dictionary {video_id: details} in the order the videos were found,
+             details['queries'] lists the keywords that found the video.
+    """
+    logger.info('Start crawl_sharded - %d queries, %d processes, %d keys',
+                len(queries), processes, len(key_pool.schedulers))
+    options = {'max_results': max_results, 'max_concurrency': max_concurrency, 'cache_file': cache_file,
+               'fields': fields}
+
+    # The records of the workers are written by the handlers of this process
+    log_queue = multiprocessing.Queue()
+    log_listener = logging.handlers.QueueListener(log_queue, _ForwardHandler())
+    log_listener.start()
+    try:
+        with ProcessPoolExecutor(processes, initializer=_init_worker_logging,
+                                 initargs=(log_queue, trace_logger.level)) as executor:
+            found = {}
+            for result in _run_phase(executor, 'search', [queries[i::processes] for i in range(processes)],
+                                     key_pool, options, metrics):
+                found.update(result)
+
+            # Merging in the keyword order, every video once
+            matched_queries = {}
+            for query in queries:
+                for video_id in found.get(query, []):
+                    queries_found = matched_queries.setdefault(video_id, [])
+                    if query not in queries_found:
+                        queries_found.append(query)
+            video_ids = list(matched_queries)
+
+            # Contiguous shards of whole batches
+            batches = -(-len(video_ids) // VIDEOS_BATCH_SIZE)
+            shard_size = max(1, -(-batches // processes)) * VIDEOS_BATCH_SIZE
+            items = {}
+            shards = [video_ids[i:i + shard_size] for i in range(0, len(video_ids), shard_size)]
+            for result in _run_phase(executor, 'details', shards, key_pool, options, metrics):
+                items.update((item.get('id'), item) for item in result)
+    finally:
+        log_listener.stop()
+
+    video_info = {video_id: {'items': [items[video_id]], 'queries': matched_queries[video_id]}
+                  for video_id in video_ids if video_id in items}
+    logger.info('crawl_sharded finished - %d unique videos', len(video_info))
+    return video_info
+
+
+def _csv_row(details: dict):
+    """Converts the details of one video to a CSV row, None if there are no details."""
+    if not details.get('items'):
+        return None
+    snippet = details['items'][0].get('snippet', {})
+    statistics = details['items'][0].get('statistics', {})
+    return [
+        snippet.get('title', 'N/A'),  # We use N/A if there is no data
+        snippet.get('channelTitle', 'N/A'),
+        statistics.get('viewCount', 0),
+        statistics.get('likeCount', 0),
+        statistics.get('commentCount', 0),
+        '; '.join(details.get('queries', []))  # keywords of the batch mode
+    ]
+
+
+def save_to_csv(video_details, filename: str) -> str:
     """ Saves video information to a CSV file.
     
-    :param video_details: video data dictionary
+    :param video_details: list of video details or dictionary {video_id: details}
     :param filename: name of the file where the information will be saved
     :return: information that the data is saved to the file.
     """
-    logging.info(f'save_to_csv filename - {filename}')
+    logger.info(f'save_to_csv filename - {filename}')
 
     # Checks for the correct format to save the file.
     if not filename.endswith('.csv'):
         filename += '.csv'
 
+    # gather_video_info and crawl_keywords return a dictionary {video_id: details}
+    if isinstance(video_details, dict):
+        video_details = list(video_details.values())
+
+    # Checking for data in video_details
+    if not isinstance(video_details, list) or not video_details:
+        logger.warning("No video details provided or video_details is not a list.")
+        return f'No video data to save in {filename}'
+
     try:
         # Opening a manager for a record indicating the utf-8 encoding
         with open(filename, mode='w', newline='', encoding='utf-8') as file:
             writer = csv.writer(file)
-            writer.writerow(['Title (Название видео)', 
-                             'Channel (Название канала)',
-                             'Views (Количество просмотров)', 
-                             'Likes (Количество лайков)', 
-                             'Comments (Количество комментариев)'])
-            
-            # Checking for data in video_details
-            if not isinstance(video_details, list) or not video_details:
-                logging.warning("No video details provided or video_details is not a list.")
-                return f'No video data to save in {filename}.'
+            writer.writerow(CSV_HEADER)
 
             for details in video_details:
-                if 'items' in details and details['items']:
-                    snippet = details['items'][0].get('snippet', {})
-                    statistics = details['items'][0].get('statistics', {})
-                    writer.writerow([
-                        snippet.get('title', 'N/A'),  # We use N/A if there is no data
-                        snippet.get('channelTitle', 'N/A'),
-                        statistics.get('viewCount', 0),
-                        statistics.get('likeCount', 0),
-                        statistics.get('commentCount', 0)
-                    ])
+                row = _csv_row(details)
+                if row is not None:
+                    writer.writerow(row)
     except (IOError, OSError) as file_err:
-        logging.error(f"Error writing to file {filename}: {file_err}")
+        logger.error(f"Error writing to file {filename}: {file_err}")
         return f"Error saving data to {filename}"
     except Exception as e:
-        logging.exception("An unexpected error occurred while saving to CSV.")
+        logger.exception("An unexpected error occurred while saving to CSV.")
         return "An unexpected error occurred when saving the data."
 
     return f'Video data is saved in {filename}'
 
 
+def _parse_timestamp(value: str):
+    """Converts an API timestamp (2024-01-31T12:00:00Z) to datetime, None if absent."""
+    if not value:
+        return None
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+@dataclasses.dataclass(slots=True)
+class VideoRecord:
+    """One video with typed fields, parsed once from the videos.list item when its
+    details arrive (stream_video_info) and shared by the exporters and the reports.
+    The counters are int, None when the video hides them.
+    """
+    video_id: str
+    channel_id: str = None
+    title: str = None
+    channel_title: str = None
+    published_at: datetime = None
+    view_count: int = None
+    like_count: int = None
+    comment_count: int = None
+    subscriber_count: int = None  # the channel statistics are joined by enrich_channels
+    channel_view_count: int = None
+    channel_video_count: int = None
+    queries: tuple = ()
+    fetched_at: datetime = None
+
+    @classmethod
+    def from_item(cls, item: dict, queries=(), fetched_at: datetime = None, channel: dict = None) -> 'VideoRecord':
+        """Parses a videos.list item.
+        
+        :param item: item of the API response
+        :param queries: keywords that found the video
+        :param fetched_at: time the item was received, now by default
+        :param channel: statistics of the channel (ChannelCache format), None - unknown
+        :return: video record.
+        """
+        snippet = item.get('snippet', {})
+        statistics = item.get('statistics', {})
+        channel = channel or {}
+        return cls(
+            video_id=item.get('id'),
+            channel_id=snippet.get('channelId'),
+            title=snippet.get('title'),
+            channel_title=snippet.get('channelTitle'),
+            published_at=_parse_timestamp(snippet.get('publishedAt')),
+            view_count=_parse_count(statistics.get('viewCount')),
+            like_count=_parse_count(statistics.get('likeCount')),
+            comment_count=_parse_count(statistics.get('commentCount')),
+            subscriber_count=channel.get('subscriber_count'),
+            channel_view_count=channel.get('view_count'),
+            channel_video_count=channel.get('video_count'),
+            queries=tuple(queries),
+            fetched_at=fetched_at or datetime.now(timezone.utc).replace(microsecond=0),
+        )
+
+    @classmethod
+    def from_details(cls, details: dict, fetched_at: datetime = None):
+        """Parses the details of one video ({'items': [item], 'queries': [...], 'channel': {...}}),
+        None if there are no details.
+        """
+        if not details.get('items'):
+            return None
+        return cls.from_item(details['items'][0], details.get('queries', ()), fetched_at, details.get('channel'))
+
+    def to_dict(self) -> dict:
+        """Returns the fields as a dictionary (queries as a list)."""
+        record = {field.name: getattr(self, field.name) for field in dataclasses.fields(self)}
+        record['queries'] = list(self.queries)
+        return record
+
+    def csv_row(self, channel_stats: bool = False) -> list:
+        """Returns the row of the CSV file (the same as _csv_row of the details),
+        with channel_stats - followed by the columns of CSV_CHANNEL_HEADER.
+        """
+        row = [
+            self.title if self.title is not None else 'N/A',
+            self.channel_title if self.channel_title is not None else 'N/A',
+            self.view_count or 0,
+            self.like_count or 0,
+            self.comment_count or 0,
+            '; '.join(self.queries),
+        ]
+        if channel_stats:
+            row += [self.subscriber_count or 0, self.channel_view_count or 0, self.channel_video_count or 0]
+        return row
+
+
+def _as_record(details):
+    """Returns the VideoRecord of a record or of the details of one video, None if there are no details."""
+    return details if isinstance(details, VideoRecord) else VideoRecord.from_details(details)
+
+
+@functools.lru_cache(maxsize=None)
+def _load_numpy():
+    """Imports numpy on first use (it is slow to import), None if it is not installed."""
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+class VideoColumns:
+    """Column store of the videos of a run for the aggregate reports.
+    
+    The counters are kept in array('q') columns (8 bytes per value, -1 for a hidden
+    counter) and the channels and keywords as integer codes, so a few hundred
+    thousand videos take a few tens of megabytes. The reports are computed with
+    numpy when it is installed and with plain Python otherwise:
+    top-N by views, top-N by the like/view ratio, totals by channel and by keyword.
+    """
+
+    def __init__(self):
+        self.video_ids, self.titles = [], []
+        self.views, self.likes, self.comments = array('q'), array('q'), array('q')
+        self.channel_codes = array('q')
+        self.channels = {}  # channel_id -> code
+        self.channel_titles = []  # code -> channel title
+        self.query_rows, self.query_codes = array('q'), array('q')  # (video row, keyword code) pairs
+        self.queries = {}  # keyword -> code
+
+    def __len__(self) -> int:
+        return len(self.video_ids)
+
+    def append(self, record: VideoRecord) -> None:
+        """Adds a video to the columns."""
+        row = len(self.video_ids)
+        self.video_ids.append(record.video_id)
+        self.titles.append(record.title)
+        self.views.append(record.view_count if record.view_count is not None else -1)
+        self.likes.append(record.like_count if record.like_count is not None else -1)
+        self.comments.append(record.comment_count if record.comment_count is not None else -1)
+        channel = record.channel_id or record.channel_title
+        if channel not in self.channels:
+            self.channels[channel] = len(self.channel_titles)
+            self.channel_titles.append(record.channel_title)
+        self.channel_codes.append(self.channels[channel])
+        for query in record.queries:
+            self.query_rows.append(row)
+            self.query_codes.append(self.queries.setdefault(query, len(self.queries)))
+
+    def extend(self, records) -> None:
+        """Adds the videos of an iterable of records."""
+        for record in records:
+            self.append(record)
+
+    def update_queries(self, queries: dict) -> None:
+        """Adds the keywords that found the videos after they were appended.
+        
+        :param queries: dictionary {video_id: all keywords of the video}.
+        """
+        rows = {video_id: row for row, video_id in enumerate(self.video_ids) if video_id in queries}
+        known = {(row, code) for row, code in zip(self.query_rows, self.query_codes)
+                 if self.video_ids[row] in queries}
+        for video_id, row in rows.items():
+            for query in queries[video_id]:
+                code = self.queries.setdefault(query, len(self.queries))
+                if (row, code) not in known:
+                    self.query_rows.append(row)
+                    self.query_codes.append(code)
+
+    def _video(self, row: int) -> dict:
+        views, likes, comments = self.views[row], self.likes[row], self.comments[row]
+        return {
+            'video_id': self.video_ids[row],
+            'title': self.titles[row],
+            'channel_title': self.channel_titles[self.channel_codes[row]],
+            'view_count': views if views >= 0 else None,
+            'like_count': likes if likes >= 0 else None,
+            'comment_count': comments if comments >= 0 else None,
+            'like_view_ratio': round(likes / views, 6) if likes >= 0 and views > 0 else None,
+        }
+
+    def top_by_views(self, n: int = REPORT_TOP_N) -> list:
+        """Returns the n most viewed videos."""
+        np = _load_numpy()
+        if np is not None:
+            views = np.frombuffer(self.views, dtype=np.int64)
+            rows = np.argsort(-views, kind='stable')[:n].tolist()
+        else:
+            rows = heapq.nlargest(n, range(len(self)), key=self.views.__getitem__)
+        return [self._video(row) for row in rows]
+
+    def top_by_like_ratio(self, n: int = REPORT_TOP_N, min_views: int = REPORT_MIN_VIEWS) -> list:
+        """Returns the n videos with the highest like/view ratio among the videos with at least min_views views."""
+        np = _load_numpy()
+        if np is not None:
+            views = np.frombuffer(self.views, dtype=np.int64)
+            likes = np.frombuffer(self.likes, dtype=np.int64)
+            ranked = np.flatnonzero((views >= max(min_views, 1)) & (likes >= 0))
+            ratios = likes[ranked] / views[ranked]
+            rows = ranked[np.argsort(-ratios, kind='stable')[:n]].tolist()
+        else:
+            ranked = [row for row in range(len(self)) if self.views[row] >= max(min_views, 1) and self.likes[row] >= 0]
+            rows = heapq.nlargest(n, ranked, key=lambda row: self.likes[row] / self.views[row])
+        return [self._video(row) for row in rows]
+
+    def _totals(self, codes, rows, size: int) -> list:
+        """Sums the counters of the rows by code (hidden counters count as 0).
+        
+        :return: list (by code) of tuples (videos, views, likes, comments).
+        """
+        np = _load_numpy()
+        if np is not None:
+            codes = np.frombuffer(codes, dtype=np.int64)
+            rows = np.frombuffer(rows, dtype=np.int64) if rows is not None else slice(None)
+            columns = [np.bincount(codes, minlength=size)]
+            for column in (self.views, self.likes, self.comments):
+                values = np.clip(np.frombuffer(column, dtype=np.int64)[rows], 0, None)
+                columns.append(np.bincount(codes, weights=values, minlength=size).round().astype(np.int64))
+            return list(zip(*(column.tolist() for column in columns)))
+        totals = [[0, 0, 0, 0] for _ in range(size)]
+        for i, code in enumerate(codes):
+            row = rows[i] if rows is not None else i
+            total = totals[code]
+            total[0] += 1
+            total[1] += max(self.views[row], 0)
+            total[2] += max(self.likes[row], 0)
+            total[3] += max(self.comments[row], 0)
+        return [tuple(total) for total in totals]
+
+    @staticmethod
+    def _aggregate(name: str, keys: list, totals: list) -> list:
+        report = [{name: key, 'videos': videos, 'view_count': views, 'like_count': likes,
+                   'comment_count': comments, 'like_view_ratio': round(likes / views, 6) if views else None}
+                  for key, (videos, views, likes, comments) in zip(keys, totals)]
+        report.sort(key=lambda row: row['view_count'], reverse=True)
+        return report
+
+    def by_channel(self) -> list:
+        """Returns the totals of every channel, the most viewed first."""
+        totals = self._totals(self.channel_codes, None, len(self.channel_titles))
+        return self._aggregate('channel_title', self.channel_titles, totals)
+
+    def by_query(self) -> list:
+        """Returns the totals of the videos found by every keyword, the most viewed first."""
+        totals = self._totals(self.query_codes, self.query_rows, len(self.queries))
+        return self._aggregate('query', list(self.queries), totals)
+
+    def write_reports(self, stem: str, top_n: int = REPORT_TOP_N) -> list:
+        """Writes the reports to CSV files <stem>_top_views.csv, <stem>_top_like_ratio.csv,
+        <stem>_channels.csv and <stem>_queries.csv.
+        
+        :param stem: output file name without the extension
+        :param top_n: rows of the top-N reports
+        :return: list of the written files.
+        """
+        paths = []
+        for suffix, report in (('top_views', self.top_by_views(top_n)),
+                               ('top_like_ratio', self.top_by_like_ratio(top_n)),
+                               ('channels', self.by_channel()),
+                               ('queries', self.by_query())):
+            if not report:
+                continue
+            filename = f'{stem}_{suffix}.csv'
+            with open(filename, 'w', newline='', encoding='utf-8') as file:
+                writer = csv.DictWriter(file, fieldnames=list(report[0]))
+                writer.writeheader()
+                writer.writerows(report)
+            paths.append(filename)
+        return paths
+
+
+class Exporter:
+    """Base class of the output formats used by write_stream.
+    
+    write(details) is called for every video, flush() periodically and close()
+    at the end. With append=True the existing data is kept; with
+    partition_by_date=True the records are written to
+    <name>/date=YYYY-MM-DD/ directories by their fetch date.
+    """
+    extension = ''
+    fields = tuple(VIDEO_FIELDS)  # record fields written by the format, see api_fields
+
+    def __init__(self, filename: str, append: bool = False, partition_by_date: bool = False):
+        if not filename.endswith(self.extension):
+            filename += self.extension
+        self.filename = filename
+        self.append = append
+        self.partition_by_date = partition_by_date
+        self.rows = 0
+        self.paths = []  # files written by the exporter
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def path(self, date=None, part: str = None) -> str:
+        """Returns the file of a partition.
+        
+        :param date: fetch date of the partition, not used without partition_by_date
+        :param part: suffix of a new part file (for formats that cannot be appended)
+        :return: file name.
+        """
+        stem = self.filename[:-len(self.extension)] if self.extension else self.filename
+        name = os.path.basename(stem) + (f'-{part}' if part else '') + self.extension
+        if self.partition_by_date:
+            directory = os.path.join(stem, f'date={date.isoformat()}')
+            os.makedirs(directory, exist_ok=True)
+            return os.path.join(directory, name)
+        return os.path.join(os.path.dirname(stem), name)
+
+    def drive_name(self, path: str) -> str:
+        """Returns the Google Drive name of a written file. The partitions of different dates
+        have the same file name, their Drive names keep the partition: date=YYYY-MM-DD_<name>.
+        """
+        if not self.partition_by_date:
+            return os.path.basename(path)
+        stem = self.filename[:-len(self.extension)] if self.extension else self.filename
+        return os.path.relpath(path, stem).replace(os.sep, '_')
+
+    def write(self, details) -> bool:
+        """Writes one video (a VideoRecord or its details), returns False if there was nothing to write."""
+        raise NotImplementedError
+
+    def flush(self) -> None:
+        pass
 
-def upload_to_drive(filename: csv) -> str:
+    def close(self) -> None:
+        pass
+
+    def update_queries(self, queries: dict) -> int:
+        """Second pass after close(): replaces the keywords of the videos written by this
+        exporter (the rows of earlier runs in an appended file are not changed).
+        Every file is rewritten through a temporary file next to it.
+        
+        :param queries: dictionary {video_id: all keywords of the video}.
+        :return: number of updated rows.
+        """
+        updated = 0
+        for path in self.paths:
+            temp_path = path + '.tmp'
+            try:
+                changed = self._update_file(path, temp_path, queries)
+            except BaseException:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+            if changed:
+                os.replace(temp_path, path)
+            else:
+                os.remove(temp_path)
+            updated += changed
+        return updated
+
+    def _update_file(self, path: str, temp_path: str, queries: dict) -> int:
+        """Writes the file with the replaced keywords to temp_path, returns the number of changed rows."""
+        raise NotImplementedError
+
+
+class _RowExporter(Exporter):
+    """Exporter of a line-based format: one open file per partition."""
+
+    def __init__(self, filename: str, append: bool = False, partition_by_date: bool = False):
+        super().__init__(filename, append, partition_by_date)
+        self._files = {}  # date -> open file
+        self._starts = {}  # file -> (size before this run, new file with a header)
+
+    def _file(self, date):
+        key = date if self.partition_by_date else None
+        if key not in self._files:
+            filename = self.path(date)
+            is_new = not (self.append and os.path.exists(filename) and os.path.getsize(filename) > 0)
+            self._starts[filename] = (0 if is_new else os.path.getsize(filename), is_new)
+            self._files[key] = self._open(filename, 'a' if self.append else 'w', is_new)
+            self.paths.append(filename)
+        return self._files[key]
+
+    def _open(self, filename: str, mode: str, is_new: bool):
+        raise NotImplementedError
+
+    def _text(self, file, mode: str):
+        """Wraps a binary file object (positioned at a frame boundary) in a text stream of the format."""
+        return io.TextIOWrapper(file, encoding='utf-8', newline='')
+
+    def _update_file(self, path: str, temp_path: str, queries: dict) -> int:
+        start, is_new = self._starts[path]
+        with open(path, 'rb') as source, open(temp_path, 'wb') as target:
+            # The data of earlier runs is copied as is
+            remaining = start
+            while remaining:
+                chunk = source.read(min(remaining, 1024 * 1024))
+                remaining -= len(chunk)
+                target.write(chunk)
+            with self._text(source, 'r') as reader, self._text(target, 'w') as writer:
+                return self._update_lines(path, reader, writer, is_new, queries)
+
+    def _update_lines(self, path: str, reader, writer, is_new: bool, queries: dict) -> int:
+        raise NotImplementedError
+
+    def flush(self) -> None:
+        for file in self._files.values():
+            file.flush()
+
+    def close(self) -> None:
+        for file in self._files.values():
+            file.close()
+        self._files = {}
+
+
+class CsvExporter(_RowExporter):
+    """The CSV file of save_to_csv (bilingual header, counters as in the API).
+    With channel_stats the channel statistics columns (CSV_CHANNEL_HEADER) are added.
+    """
+    extension = '.csv'
+    fields = ('title', 'channel_title', 'view_count', 'like_count', 'comment_count')
+
+    def __init__(self, filename: str, append: bool = False, partition_by_date: bool = False,
+                 channel_stats: bool = False):
+        super().__init__(filename, append, partition_by_date)
+        self.channel_stats = channel_stats
+        if channel_stats:
+            self.fields = self.fields + ('channel_id',)
+        self._video_ids = {}  # file -> video IDs of the rows, the CSV file has no ID column
+
+    def _open(self, filename: str, mode: str, is_new: bool):
+        file = open(filename, mode=mode, newline='', encoding='utf-8')
+        file.writer = csv.writer(file)
+        if is_new:
+            file.writer.writerow(CSV_HEADER + CSV_CHANNEL_HEADER if self.channel_stats else CSV_HEADER)
+        return file
+
+    def write(self, details) -> bool:
+        record = _as_record(details)
+        if record is None:
+            return False
+        file = self._file(record.fetched_at.date())
+        file.writer.writerow(record.csv_row(self.channel_stats))
+        self._video_ids.setdefault(file.name, []).append(record.video_id)
+        self.rows += 1
+        return True
+
+    def _update_lines(self, path: str, reader, writer, is_new: bool, queries: dict) -> int:
+        rows, output = csv.reader(reader), csv.writer(writer)
+        if is_new:
+            output.writerow(next(rows))  # header
+        column = len(CSV_HEADER) - 1  # Queries
+        changed = 0
+        for video_id, row in zip(self._video_ids.get(path, ()), rows):
+            if video_id in queries:
+                row[column] = '; '.join(queries[video_id])
+                changed += 1
+            output.writerow(row)
+        return changed
+
+
+class NdjsonExporter(_RowExporter):
+    """Newline-delimited JSON with typed fields, compressed with gzip (default),
+    zstd (needs the zstandard module) or not compressed (compression=None).
+    Appending adds a new compressed frame, which readers handle transparently.
+    """
+
+    def __init__(self, filename: str, append: bool = False, partition_by_date: bool = False,
+                 compression: str = 'gzip'):
+        self.extension = {'gzip': '.ndjson.gz', 'zstd': '.ndjson.zst', None: '.ndjson'}[compression]
+        self.compression = compression
+        if compression == 'zstd':
+            try:
+                import zstandard
+            except ImportError as e:
+                raise ImportError('The zstandard module is required for zstd compression: pip install zstandard') from e
+            self._zstandard = zstandard
+        super().__init__(filename, append, partition_by_date)
+
+    def _open(self, filename: str, mode: str, is_new: bool):
+        if self.compression == 'gzip':
+            return gzip.open(filename, mode + 't', encoding='utf-8')
+        if self.compression == 'zstd':
+            return self._zstandard.open(filename, mode + 't', encoding='utf-8')
+        return open(filename, mode, encoding='utf-8')
+
+    def _text(self, file, mode: str):
+        if self.compression == 'gzip':
+            file = gzip.GzipFile(fileobj=file, mode=mode + 'b')
+        elif self.compression == 'zstd':
+            if mode == 'r':
+                file = self._zstandard.ZstdDecompressor().stream_reader(file, read_across_frames=True)
+            else:
+                file = self._zstandard.ZstdCompressor().stream_writer(file)
+        return super()._text(file, mode)
+
+    def _update_lines(self, path: str, reader, writer, is_new: bool, queries: dict) -> int:
+        changed = 0
+        for line in reader:
+            record = json.loads(line)
+            if record.get('video_id') in queries:
+                record['queries'] = list(queries[record['video_id']])
+                line = json.dumps(record, ensure_ascii=False) + '\n'
+                changed += 1
+            writer.write(line)
+        return changed
+
+    def write(self, details) -> bool:
+        record = _as_record(details)
+        if record is None:
+            return False
+        partition = record.fetched_at.date()
+        record = record.to_dict()
+        for field in ('published_at', 'fetched_at'):
+            if record[field] is not None:
+                record[field] = record[field].isoformat()
+        self._file(partition).write(json.dumps(record, ensure_ascii=False) + '\n')
+        self.rows += 1
+        return True
+
+
+class _ArrowExporter(Exporter):
+    """Exporter of a typed columnar format built with pyarrow.
+    Records are buffered and written in blocks of row_group_size rows. These
+    formats cannot be appended: in append mode every run writes a new part file
+    next to the previous ones (name-<run time>.ext), which pandas/DuckDB read as one
+    dataset. flush() does not write incomplete blocks.
+    """
+
+    def __init__(self, filename: str, append: bool = False, partition_by_date: bool = False,
+                 row_group_size: int = EXPORT_ROW_GROUP_SIZE):
+        try:
+            import pyarrow
+        except ImportError as e:
+            raise ImportError(f'The pyarrow module is required for the {self.extension} format: pip install pyarrow') from e
+        self._pa = pyarrow
+        super().__init__(filename, append, partition_by_date)
+        self.row_group_size = row_group_size
+        self.schema = pyarrow.schema([
+            ('video_id', pyarrow.string()),
+            ('channel_id', pyarrow.string()),
+            ('title', pyarrow.string()),
+            ('channel_title', pyarrow.string()),
+            ('published_at', pyarrow.timestamp('s', tz='UTC')),
+            ('view_count', pyarrow.int64()),
+            ('like_count', pyarrow.int64()),
+            ('comment_count', pyarrow.int64()),
+            ('subscriber_count', pyarrow.int64()),
+            ('channel_view_count', pyarrow.int64()),
+            ('channel_video_count', pyarrow.int64()),
+            ('queries', pyarrow.list_(pyarrow.string())),
+            ('fetched_at', pyarrow.timestamp('s', tz='UTC')),
+        ])
+        self._part = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%f') if append else None
+        self._buffers = {}  # date -> buffered records
+        self._writers = {}  # date -> open writer
+
+    def write(self, details) -> bool:
+        record = _as_record(details)
+        if record is None:
+            return False
+        record = record.to_dict()
+        key = record['fetched_at'].date() if self.partition_by_date else None
+        buffer = self._buffers.setdefault(key, [])
+        buffer.append(record)
+        self.rows += 1
+        if len(buffer) >= self.row_group_size:
+            self._write_buffer(key)
+        return True
+
+    def close(self) -> None:
+        for key in list(self._buffers):
+            self._write_buffer(key)
+        for writer in self._writers.values():
+            writer.close()
+        self._writers = {}
+
+    def _write_buffer(self, key) -> None:
+        buffer = self._buffers.pop(key, None)
+        if not buffer:
+            return
+        if key not in self._writers:
+            date = key or buffer[0]['fetched_at'].date()
+            filename = self.path(date, self._part)
+            self._writers[key] = self._open(filename)
+            self.paths.append(filename)
+        table = self._pa.Table.from_pylist(buffer, schema=self.schema)
+        self._writers[key].write_table(table)
+
+    def _open(self, filename: str):
+        raise NotImplementedError
+
+    def _batches(self, path: str):
+        """Yields the record batches of a written file."""
+        raise NotImplementedError
+
+    def _update_file(self, path: str, temp_path: str, queries: dict) -> int:
+        # The files of a run are never appended, the whole file is rewritten batch by batch
+        changed = 0
+        writer = self._open(temp_path)
+        try:
+            for batch in self._batches(path):
+                video_ids = batch.column('video_id').to_pylist()
+                if any(video_id in queries for video_id in video_ids):
+                    values = batch.column('queries').to_pylist()
+                    for i, video_id in enumerate(video_ids):
+                        if video_id in queries:
+                            values[i] = list(queries[video_id])
+                            changed += 1
+                    column = batch.schema.get_field_index('queries')
+                    batch = self._pa.RecordBatch.from_arrays(
+                        [self._pa.array(values, type=self.schema.field('queries').type) if i == column
+                         else batch.column(i) for i in range(batch.num_columns)], schema=self.schema)
+                writer.write_table(self._pa.Table.from_batches([batch], schema=self.schema))
+        finally:
+            writer.close()
+        return changed
+
+
+class ParquetExporter(_ArrowExporter):
+    """Parquet file with typed columns, zstd-compressed."""
+    extension = '.parquet'
+
+    def _open(self, filename: str):
+        import pyarrow.parquet
+        return pyarrow.parquet.ParquetWriter(filename, self.schema, compression='zstd')
+
+    def _batches(self, path: str):
+        import pyarrow.parquet
+        yield from pyarrow.parquet.ParquetFile(path).iter_batches(batch_size=self.row_group_size)
+
+
+class ArrowExporter(_ArrowExporter):
+    """Arrow IPC (Feather v2) file with typed columns."""
+    extension = '.arrow'
+
+    def _open(self, filename: str):
+        return self._pa.ipc.new_file(filename, self.schema)
+
+    def _batches(self, path: str):
+        with self._pa.OSFile(path, 'rb') as file:
+            reader = self._pa.ipc.open_file(file)
+            for i in range(reader.num_record_batches):
+                yield reader.get_batch(i)
+
+
+EXPORTERS = {
+    'csv': CsvExporter,
+    'ndjson': NdjsonExporter,
+    'parquet': ParquetExporter,
+    'arrow': ArrowExporter,
+}
+
+
+def make_exporter(export_format: str = 'csv', filename: str = 'youtube_videos', **options) -> Exporter:
+    """Creates the exporter of an output format.
+    
+    :param export_format: one of EXPORTERS (csv, ndjson, parquet, arrow)
+    :param filename: name of the file, the extension of the format is added if missing
+    :param options: append, partition_by_date and the options of the format (compression for ndjson)
+    :return: exporter.
+    """
+    if export_format not in EXPORTERS:
+        raise ValueError(f'Unknown export format: {export_format}')
+    return EXPORTERS[export_format](filename, **options)
+
+
+async def write_stream(queue: asyncio.Queue, exporter: Exporter, flush_rows: int = CSV_FLUSH_ROWS,
+                       flush_interval: float = CSV_FLUSH_INTERVAL, columns: VideoColumns = None) -> int:
+    """An asynchronous function that writes video details from the queue with an exporter
+    as they arrive, until None is received.
+    The exporter is flushed every flush_rows rows or flush_interval seconds, so an
+    interrupted run leaves a usable partial file (for the line-based formats).
+    
+    :param queue: queue filled by stream_video_info
+    :param exporter: output format
+    :param flush_rows: number of rows between flushes
+    :param flush_interval: maximum number of seconds between flushes
+    :param columns: column store of the reports, the written videos are added to it
+    :return: number of written rows.
+    """
+    logger.info(f'write_stream filename - {exporter.filename}')
+
+    rows = unflushed = 0
+    with exporter:
+        last_flush = time.monotonic()
+        while True:
+            try:
+                details = await asyncio.wait_for(queue.get(), timeout=flush_interval)
+            except asyncio.TimeoutError:
+                details = {}  # nothing arrived, only the time-based flush below
+            if details is None:
+                break
+            record = _as_record(details) if details else None
+            if record is not None and exporter.write(record):
+                rows += 1
+                unflushed += 1
+                if columns is not None:
+                    columns.append(record)
+            if unflushed and (unflushed >= flush_rows or time.monotonic() - last_flush >= flush_interval):
+                exporter.flush()
+                unflushed = 0
+                last_flush = time.monotonic()
+
+    logger.info('write_stream finished - %d rows', rows)
+    return rows
+
+
+async def run_pipeline(queries: list, client: YouTubeClient, filename: str = CSV_FILENAME,
+                       max_results: int = SEARCH_PAGE_SIZE,
+                       max_concurrency: int = QUERIES_MAX_CONCURRENCY,
+                       store: StatsStore = None, exporter: Exporter = None,
+                       columns: VideoColumns = None, channel_cache: ChannelCache = None) -> int:
+    """An asynchronous function that runs the searches and the writer as a
+    producer/consumer pair connected by a bounded asyncio.Queue.
+    
+    :param queries: list of keywords for video search
+    :param client: shared HTTP client
+    :param filename: name of the CSV file, used when no exporter is given
+    :param max_results: number of search results for each keyword
+    :param max_concurrency: number of keywords searched at the same time
+    :param store: store of the known videos for the refresh mode, None - not stored.
+    :param exporter: output format, CsvExporter(filename) by default
+    :param columns: column store of the reports, None - no reports
+    :param channel_cache: cache of the channel statistics joined onto the records, None - no channel statistics
+    :return: number of written rows.
+    """
+    if exporter is None:
+        exporter = CsvExporter(filename)
+    queue = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+    channels = ChannelBatcher(client, channel_cache) if channel_cache is not None else None
+    producer = asyncio.ensure_future(stream_video_info(queries, client, queue, max_results=max_results,
+                                                       max_concurrency=max_concurrency, store=store,
+                                                       channels=channels))
+    writer = asyncio.ensure_future(write_stream(queue, exporter, columns=columns))
+    try:
+        done, _ = await asyncio.wait({producer, writer}, return_when=asyncio.FIRST_COMPLETED)
+        if writer in done:
+            # The writer stopped before the producer (a file error), nobody reads the queue any more
+            producer.cancel()
+        else:
+            await queue.put(None)
+        rows = await writer
+        if not producer.cancelled() and producer.exception() is None:
+            late = producer.result()
+            # Second pass: the keywords that found the videos after they were written
+            if late:
+                logger.info('Adding late keywords of %d videos', len(late))
+                exporter.update_queries(late)
+                if columns is not None:
+                    columns.update_queries(late)
+        return rows
+    finally:
+        for task in (producer, writer):
+            if not task.done():
+                task.cancel()
+        if channels is not None:
+            await channels.close()
+
+
+@functools.lru_cache(maxsize=None)
+def get_drive_service(service_account_file: str = SERVICE_ACCOUNT_FILE):
+    """Returns the Google Drive client, created once per credentials file.
+    The client is built from the discovery document shipped with googleapiclient,
+    without downloading it.
+    
+    :param service_account_file: path to the service account credentials.
+    :return: Google Drive v3 service.
+    """
+    service_account, build, _, _ = _load_drive_modules()
+    creds = service_account.Credentials.from_service_account_file(service_account_file, scopes=SCOPES)
+    return build('drive', 'v3', credentials=creds, static_discovery=True, cache_discovery=False)
+
+
+def _gzip_file(filename: str) -> str:
+    """Compresses a file with gzip next to the original, returns the name of the .gz file."""
+    gz_filename = filename + '.gz'
+    with open(filename, 'rb') as source, gzip.open(gz_filename, 'wb') as target:
+        shutil.copyfileobj(source, target)
+    return gz_filename
+
+
+def _find_drive_file(service, name: str):
+    """Finds a file on Google Drive by name, returns its ID or None."""
+    escaped = name.replace('\\', '\\\\').replace("'", "\\'")
+    response = service.files().list(q=f"name = '{escaped}' and trashed = false",
+                                    fields='files(id)', pageSize=1).execute()
+    files = response.get('files', [])
+    return files[0]['id'] if files else None
+
+
+def upload_to_drive(filename: str, compress: bool = False, update: bool = False, file_id: str = None,
+                    chunk_size: int = DRIVE_CHUNK_SIZE, retries: int = DRIVE_UPLOAD_RETRIES,
+                    service=None, name: str = None) -> str:
     """Uploads a file with video data to Google Drive.
+    The upload is resumable and sent in chunks: a failed chunk is retried from
+    the last offset saved by Drive instead of starting the file over.
     
     :param filename: name of the file to be saved to Google Drive
+    :param compress: compress the file with gzip before uploading (the .gz file is removed afterwards)
+    :param update: replace the content of the Drive file with the same name instead of creating a copy
+    :param file_id: ID of the Drive file whose content is replaced
+    :param chunk_size: bytes in one chunk (a multiple of 256 KiB)
+    :param retries: retries of a failed chunk
+    :param service: Google Drive client, get_drive_service() by default
+    :param name: name of the Drive file (found by update), the base name of filename by default
     :return: information that the data is saved to the file.
     """
     
-    logging.info(f'Uploading to Google Drive: {filename}')
+    logger.info(f'Uploading to Google Drive: {filename}')
     
     # Checking for file existence
     if not os.path.isfile(filename):
-        logging.error(f'File not found: {filename}')
+        logger.error(f'File not found: {filename}')
         return f'Error: File not found - {filename}'
     
+    _, _, MediaFileUpload, HttpError = _load_drive_modules()
+    gz_filename = None
     try:
-        creds = service_account.Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=SCOPES)
-        service = build('drive', 'v3', credentials=creds)
+        service = service or get_drive_service()
+        
+        if compress and not filename.endswith('.gz'):
+            filename = gz_filename = _gzip_file(filename)
+            name = name and name + '.gz'
+        name = name or os.path.basename(filename)  # We only get the file name
+        mimetype = DRIVE_MIMETYPES.get(os.path.splitext(name)[1], 'application/octet-stream')
+        media = MediaFileUpload(filename, mimetype=mimetype, resumable=True, chunksize=chunk_size)
         
-        file_metadata = {'name': os.path.basename(filename)}  # We only get the file name
-        media = MediaFileUpload(filename, mimetype='text/csv')
+        if file_id is None and update:
+            file_id = _find_drive_file(service, name)
+        if file_id is not None:
+            request = service.files().update(fileId=file_id, media_body=media, fields='id')
+        else:
+            request = service.files().create(body={'name': name}, media_body=media, fields='id')
         
-        # Making a file download request
-        file = service.files().create(body=file_metadata, media_body=media, fields='id').execute()
-        logging.info(f'File uploaded successfully with ID: {file.get("id")}')
+        # Sending the file in chunks, next_chunk retries a failed chunk from the saved offset
+        response = None
+        while response is None:
+            status, response = request.next_chunk(num_retries=retries)
+            if status is not None:
+                logger.info('Upload of %s: %d%%', name, int(status.progress() * 100))
+        logger.info(f'File uploaded successfully with ID: {response.get("id")}')
         
-        return f'The file is uploaded to Google Drive with ID: {file.get("id")}'
+        if file_id is not None:
+            return f'The file is updated on Google Drive with ID: {response.get("id")}'
+        return f'The file is uploaded to Google Drive with ID: {response.get("id")}'
     
     except FileNotFoundError as fnf_error:
-        logging.error(f'File not found: {fnf_error}')
+        logger.error(f'File not found: {fnf_error}')
         return f'Error: File not found - {fnf_error}'
     except HttpError as http_err:
-        logging.error(f'An HTTP error occurred: {http_err}')
+        logger.error(f'An HTTP error occurred: {http_err}')
         return f'Error: HTTP error occurred - {http_err}'
     except Exception as e:
-        logging.exception('An unexpected error occurred while uploading to Google Drive.')
+        logger.exception('An unexpected error occurred while uploading to Google Drive.')
         return 'An unexpected error occurred while uploading the file to Google Drive.'
+    finally:
+        if gz_filename is not None and os.path.exists(gz_filename):
+            os.remove(gz_filename)  # the compressed copy is only needed for the upload
 
 
-async def main():
+def _save_and_upload(exporter: Exporter, upload_options: dict = None, columns: VideoColumns = None) -> None:
+    """Reports the files written by the exporter and uploads them to Google Drive.
+    With columns, the aggregate reports are written next to the output file.
+    """
+    if columns is not None:
+        stem = exporter.filename[:-len(exporter.extension)] if exporter.extension else exporter.filename
+        for filename in columns.write_reports(stem):
+            logger.info('Report has been saved in %s', filename)
+            print(f'Report is saved in {filename}')
+
+    for filename in exporter.paths:
+        logger.info('Video data has been saved in %s', filename)
+        print(f'Video data is saved in {filename}')
+
+        upload_message = upload_to_drive(filename, name=exporter.drive_name(filename), **(upload_options or {}))
+        logger.info('File has been uploaded to Google Drive')
+        print(upload_message)
+
+
+def _record_fields(exporter: Exporter, reports: bool = False, channel_cache: ChannelCache = None) -> tuple:
+    """Returns the record fields requested from videos.list for the exporter and the options."""
+    return (exporter.fields + (REPORT_FIELDS if reports else ())
+            + (('channel_id',) if channel_cache is not None else ()))
+
+
+async def main(max_results: int = SEARCH_PAGE_SIZE, cache: ResponseCache = None,
+               store: StatsStore = None, exporter: Exporter = None, upload_options: dict = None,
+               key_pool: ApiKeyPool = None, metrics: Metrics = None, reports: bool = False,
+               channel_cache: ChannelCache = None):
     """ The main asynchronous function that receives information about the video search data,
-    after which it calls the search_youtube function, searches if everything calls the function successfully
-    gather_video_info to get the necessary video data.
-    Afterwards, the data is written in the save_to_csv function to a .csv file
+    after which it streams the search pages and the video data through run_pipeline,
+    which writes the rows to a .csv file (or another exporter format) as they arrive.
+    
+    :param max_results: total number of search results, may exceed one page (50).
+    :param cache: on-disk response cache, None - every response is downloaded.
+    :param store: store of the known videos for the refresh mode, None - not stored.
+    :param exporter: output format, CsvExporter(CSV_FILENAME) by default.
+    :param upload_options: arguments of upload_to_drive (compress, update).
+    :param key_pool: API keys with their quota schedulers, YOUTUBE_API_KEY if not given.
+    :param metrics: request counters of the run, None - not kept.
+    :param reports: write the aggregate reports (VideoColumns) next to the output file.
+    :param channel_cache: cache of the channel statistics joined onto the records, None - no channel statistics.
     """
     
     query = input("Введите ключевое слово для поиска: ")
+    exporter = exporter or CsvExporter(CSV_FILENAME)
+    columns = VideoColumns() if reports else None
     
     try:
-        video_data = search_youtube(query)
+        # One pooled session for all requests of the run
+        async with YouTubeClient(cache=cache, key_pool=key_pool, metrics=metrics,
+                                 fields=api_fields(_record_fields(exporter, reports, channel_cache))) as client:
+            rows = await run_pipeline([query], client, max_results=max_results, store=store,
+                                      exporter=exporter, columns=columns, channel_cache=channel_cache)
+        if not rows:
+            logger.warning("No video data found for the query: %s", query)
+            return f'There are no video data available for your request.'
         
-        if not video_data:
-            logging.warning("No video data found for the query: %s", query)
+        _save_and_upload(exporter, upload_options, columns)
+
+    except Exception as e:
+        logger.exception('An error occurred during the main process: %s', e)
+
+
+async def main_batch(queries: list, max_results: int = SEARCH_PAGE_SIZE,
+                     max_concurrency: int = QUERIES_MAX_CONCURRENCY, cache: ResponseCache = None,
+                     store: StatsStore = None, exporter: Exporter = None, upload_options: dict = None,
+                     key_pool: ApiKeyPool = None, metrics: Metrics = None, reports: bool = False,
+                     channel_cache: ChannelCache = None):
+    """ The main asynchronous function of the batch mode: searches all keywords through
+    run_pipeline, writes the unique videos with their keywords to a .csv file
+    (or another exporter format) and uploads it to Google Drive.
+    
+    :param queries: list of keywords for video search
+    :param max_results: number of search results for each keyword
+    :param max_concurrency: number of keywords searched at the same time
+    :param cache: on-disk response cache, None - every response is downloaded.
+    :param store: store of the known videos for the refresh mode, None - not stored.
+    :param exporter: output format, CsvExporter(CSV_FILENAME) by default.
+    :param upload_options: arguments of upload_to_drive (compress, update).
+    :param key_pool: API keys with their quota schedulers, YOUTUBE_API_KEY if not given.
+    :param metrics: request counters of the run, None - not kept.
+    :param reports: write the aggregate reports (VideoColumns) next to the output file.
+    :param channel_cache: cache of the channel statistics joined onto the records, None - no channel statistics.
+    """
+    
+    exporter = exporter or CsvExporter(CSV_FILENAME)
+    columns = VideoColumns() if reports else None
+    try:
+        async with YouTubeClient(cache=cache, key_pool=key_pool, metrics=metrics,
+                                 fields=api_fields(_record_fields(exporter, reports, channel_cache))) as client:
+            rows = await run_pipeline(queries, client, max_results=max_results,
+                                      max_concurrency=max_concurrency, store=store, exporter=exporter,
+                                      columns=columns, channel_cache=channel_cache)
+        if not rows:
+            logger.warning("No video data found for the queries: %s", queries)
             return f'There are no video data available for your request.'
         
-        video_info = await gather_video_info(video_data)
+        _save_and_upload(exporter, upload_options, columns)
+
+    except Exception as e:
+        logger.exception('An error occurred during the batch process: %s', e)
+
+
+async def main_refresh(store: StatsStore, cache: ResponseCache = None, key_pool: ApiKeyPool = None,
+                       metrics: Metrics = None):
+    """ The main asynchronous function of the refresh mode: re-polls the statistics
+    of the videos already in the store and appends snapshots for the changed ones.
+    
+    :param store: store of the known videos
+    :param cache: on-disk response cache, None - every response is downloaded.
+    :param key_pool: API keys with their quota schedulers, YOUTUBE_API_KEY if not given.
+    :param metrics: request counters of the run, None - not kept.
+    """
+    
+    try:
+        async with YouTubeClient(cache=cache, key_pool=key_pool, metrics=metrics) as client:
+            changed = await refresh_statistics(store, client)
+        print(f'Statistics changed for {changed} videos, saved in {store.filename}')
+    except Exception as e:
+        logger.exception('An error occurred during the refresh process: %s', e)
+
+
+async def _enrich_sharded(video_info: dict, key_pool: ApiKeyPool, channel_cache: ChannelCache,
+                          cache_file: str = None, metrics: Metrics = None) -> None:
+    """Joins the channel statistics onto the merged results of crawl_sharded in the main process
+    (the distinct channels of all shards are requested together)."""
+    cache = ResponseCache(cache_file) if cache_file else None
+    try:
+        async with YouTubeClient(cache=cache, key_pool=key_pool, metrics=metrics) as client:
+            await enrich_channels(video_info, client, channel_cache)
+    finally:
+        if cache is not None:
+            cache.close()
+
+
+def main_sharded(queries: list, key_pool: ApiKeyPool, processes: int = SHARD_PROCESSES,
+                 max_results: int = SEARCH_PAGE_SIZE, max_concurrency: int = QUERIES_MAX_CONCURRENCY,
+                 cache_file: str = None, store: StatsStore = None, exporter: Exporter = None,
+                 upload_options: dict = None, metrics: Metrics = None, reports: bool = False,
+                 channel_cache: ChannelCache = None):
+    """ The main function of the sharded mode: searches the keywords with crawl_sharded
+    in a pool of worker processes, writes the merged unique videos with the exporter
+    and uploads the files to Google Drive.
+    
+    :param queries: list of keywords for video search
+    :param key_pool: API keys with their quota schedulers
+    :param processes: number of worker processes
+    :param max_results: number of search results for each keyword
+    :param max_concurrency: number of keywords searched at the same time in each worker
+    :param cache_file: on-disk response cache shared by the workers, None - no cache
+    :param store: store of the known videos for the refresh mode, None - not stored.
+    :param exporter: output format, CsvExporter(CSV_FILENAME) by default.
+    :param upload_options: arguments of upload_to_drive (compress, update).
+    :param metrics: request counters of the run, None - not kept.
+    :param reports: write the aggregate reports (VideoColumns) next to the output file.
+    :param channel_cache: cache of the channel statistics joined onto the records, None - no channel statistics.
+    """
+    
+    exporter = exporter or CsvExporter(CSV_FILENAME)
+    columns = VideoColumns() if reports else None
+    try:
+        video_info = crawl_sharded(queries, key_pool, processes=processes, max_results=max_results,
+                                   max_concurrency=max_concurrency, cache_file=cache_file, metrics=metrics,
+                                   fields=api_fields(_record_fields(exporter, reports, channel_cache)))
         if not video_info:
-            logging.warning("No video info retrieved.")
-            return f"Unable to retrieve video information."
+            logger.warning("No video data found for the queries: %s", queries)
+            return f'There are no video data available for your request.'
         
-        csv_filename = 'youtube_videos.csv'
-        save_message = save_to_csv(video_info, filename=csv_filename)
-        logging.info('Video data has been saved in %s', csv_filename)
-        print(save_message)
-
-        upload_message = upload_to_drive(csv_filename)
-        logging.info('File has been uploaded to Google Drive')
-        print(upload_message)
+        if store is not None:
+            store.add_videos(video_info)
+        if channel_cache is not None:
+            asyncio.run(_enrich_sharded(video_info, key_pool, channel_cache, cache_file, metrics))
+        with exporter:
+            for details in video_info.values():
+                record = VideoRecord.from_details(details)
+                if record is not None and exporter.write(record) and columns is not None:
+                    columns.append(record)
+        _save_and_upload(exporter, upload_options, columns)
 
     except Exception as e:
-        logging.exception('An error occurred during the main process: %s', e)
+        logger.exception('An error occurred during the sharded process: %s', e)
+
+
+def parse_args(argv: list = None) -> argparse.Namespace:
+    """Parses the command line arguments.
+    Without keywords the script asks for one keyword interactively.
+    
+    :param argv: list of arguments, sys.argv by default.
+    :return: parsed arguments.
+    """
+    parser = argparse.ArgumentParser(description='Search YouTube videos and save the data to a CSV file.')
+    parser.add_argument('keywords', nargs='*', help='keywords for video search (batch mode)')
+    parser.add_argument('-f', '--keywords-file', help='file with keywords, one per line (batch mode)')
+    parser.add_argument('-n', '--max-results', type=int, default=SEARCH_PAGE_SIZE,
+                        help='number of search results for each keyword')
+    parser.add_argument('--max-concurrency', type=int, default=QUERIES_MAX_CONCURRENCY,
+                        help='number of keywords searched at the same time')
+    parser.add_argument('--cache-file', default=CACHE_FILE, help='file of the on-disk response cache')
+    parser.add_argument('--no-cache', action='store_true', help='download every response')
+    parser.add_argument('--stats-store', default=STATS_STORE_FILE, help='file of the known videos and their statistics')
+    parser.add_argument('--refresh', action='store_true',
+                        help='only re-poll the statistics of the videos in the stats store')
+    parser.add_argument('--format', choices=sorted(EXPORTERS), default='csv', help='output format')
+    parser.add_argument('-o', '--output', default=os.path.splitext(CSV_FILENAME)[0],
+                        help='output file name, the extension of the format is added')
+    parser.add_argument('--compression', choices=['gzip', 'zstd', 'none'], default='gzip',
+                        help='compression of the ndjson format')
+    parser.add_argument('--append', action='store_true', help='keep the existing output data')
+    parser.add_argument('--partition-by-date', action='store_true',
+                        help='write the output to <output>/date=YYYY-MM-DD/ directories')
+    parser.add_argument('--quota-units', type=int, default=QUOTA_DAILY_UNITS, help='daily quota budget in units')
+    parser.add_argument('--quota-rate', type=float, default=QUOTA_REQUESTS_PER_SECOND,
+                        help='maximum number of API requests per second')
+    parser.add_argument('--quota-state', default=QUOTA_STATE_FILE,
+                        help='base name of the files of the units spent today (one per API key)')
+    parser.add_argument('--api-key', action='append', default=[], help='API key, may be given several times')
+    parser.add_argument('--api-keys-file', help='file with API keys, one per line')
+    parser.add_argument('--processes', type=int,
+                        help=f'sharded mode: search in this number of worker processes (e.g. {SHARD_PROCESSES})')
+    parser.add_argument('--reports', action='store_true',
+                        help='write the top-N, like/view ratio, channel and keyword reports next to the output')
+    parser.add_argument('--channels', action='store_true',
+                        help='add the subscriber, view and video counts of the video channels')
+    parser.add_argument('--metrics', help='file of the request metrics: .json - JSON summary, '
+                                          'otherwise the Prometheus text format')
+    parser.add_argument('--trace', help='file of the per-request trace (JSON lines)')
+    parser.add_argument('--upload-gzip', action='store_true', help='compress the output with gzip before uploading')
+    parser.add_argument('--upload-update', action='store_true',
+                        help='replace the Google Drive file with the same name instead of creating a copy')
+    return parser.parse_args(argv)
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    args = parse_args()
+    log_listener = setup_logging(trace_file=args.trace)
+    metrics = Metrics()
+    queries = list(args.keywords)
+    if args.keywords_file:
+        queries += read_keywords(args.keywords_file)
+    queries = list(dict.fromkeys(queries))
+    cache = None if args.no_cache else ResponseCache(args.cache_file)
+    channel_cache = ChannelCache(None if args.no_cache else args.cache_file) if args.channels else None
+    store = StatsStore(args.stats_store)
+    export_options = {'append': args.append, 'partition_by_date': args.partition_by_date}
+    if args.format == 'ndjson':
+        export_options['compression'] = None if args.compression == 'none' else args.compression
+    if args.format == 'csv' and args.channels:
+        export_options['channel_stats'] = True
+    exporter = make_exporter(args.format, args.output, **export_options)
+    upload_options = {'compress': args.upload_gzip, 'update': args.upload_update}
+    api_keys = list(args.api_key)
+    if args.api_keys_file:
+        api_keys += read_keywords(args.api_keys_file)
+    key_pool = ApiKeyPool.from_keys(list(dict.fromkeys(api_keys)) or [YOUTUBE_API_KEY], args.quota_units,
+                                    args.quota_rate, state_file=args.quota_state)
+
+    try:
+        if args.refresh:
+            asyncio.run(main_refresh(store, cache=cache, key_pool=key_pool, metrics=metrics))
+        elif queries and args.processes:
+            main_sharded(queries, key_pool, processes=args.processes, max_results=args.max_results,
+                         max_concurrency=args.max_concurrency, cache_file=None if args.no_cache else args.cache_file,
+                         store=store, exporter=exporter, upload_options=upload_options, metrics=metrics,
+                         reports=args.reports, channel_cache=channel_cache)
+        elif queries:
+            asyncio.run(main_batch(queries, max_results=args.max_results, max_concurrency=args.max_concurrency,
+                                   cache=cache, store=store, exporter=exporter, upload_options=upload_options,
+                                   key_pool=key_pool, metrics=metrics, reports=args.reports,
+                                   channel_cache=channel_cache))
+        else:
+            asyncio.run(main(max_results=args.max_results, cache=cache, store=store, exporter=exporter,
+                             upload_options=upload_options, key_pool=key_pool, metrics=metrics,
+                             reports=args.reports, channel_cache=channel_cache))
+    finally:
+        store.close()
+        key_pool.save()
+        logger.info('Quota: %s', key_pool.stats())
+        if key_pool.exhausted:
+            print(f'Quota budget is spent for all API keys, some data was not requested - see {LOG_FILE}')
+        if cache is not None:
+            logger.info('Response cache: %s', cache.stats())
+            cache.close()
+        if channel_cache is not None:
+            logger.info('Channel cache: %s', channel_cache.stats())
+            channel_cache.close()
+        logger.info('Requests: %s', {name: sum(counters['requests'].values())
+                                     for name, counters in metrics.endpoints.items()})
+        if args.metrics:
+            metrics.save(args.metrics)
+        log_listener.stop()